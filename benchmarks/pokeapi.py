@@ -0,0 +1,191 @@
+"""
+Record/replay of PokéAPI, so crawls can be timed without network access.
+
+`record` runs a crawl against the real API and stores every response it gets into a fixture archive
+(a zip file with one member per endpoint). `StandIn` is a local HTTP server that serves an archive
+as if it was PokéAPI, with optional latency, 429 responses and server errors. Point the app at it
+with the `POKEAPI_URL` environment variable.
+
+Run it from the root of the project with:
+
+```bash
+poetry run python -m benchmarks.pokeapi record benchmarks/fixtures/pokeapi.zip
+poetry run python -m benchmarks.pokeapi serve benchmarks/fixtures/pokeapi.zip --port 8001 --latency 0.05 --rate-limited 0.01
+```
+"""
+
+
+import argparse, hashlib, json, random, threading, time, zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import patch
+from src.resources import fetcher
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+METADATA = '__metadata__.json' # Archive member with the URL responses were recorded from
+
+
+def record(archive: Path, limit = 9999, max_workers: int | None = None) -> int:
+    """Crawls PokéAPI like an update from scratch would (see `get_data`), and writes every response
+    to the `archive`. The HTTP cache is bypassed, so every endpoint is actually requested. Returns
+    the number of recorded endpoints."""
+
+    responses = {}
+    lock = threading.Lock()
+    get = fetcher.session.get
+
+    def recording_get(url: str, **kwargs):
+        response = get(url, **kwargs)
+        if response.status_code == 200:
+            with lock:
+                responses[url.removeprefix(fetcher.base_url)] = response.content
+        return response
+
+    with patch.object(fetcher.session, 'get', recording_get), patch.object(fetcher, 'cache', None):
+        fetcher.get_data(limit, max_workers)
+        fetcher.call('type')
+
+    archive.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as file:
+        file.writestr(METADATA, json.dumps({'base_url': fetcher.base_url, 'endpoints': len(responses)}))
+        for endpoint, content in sorted(responses.items()):
+            file.writestr(endpoint, content)
+
+    return len(responses)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves the responses of the `StandIn` it belongs to."""
+
+    server: 'StandIn'
+
+    def do_GET(self):
+        server = self.server
+        endpoint = self.path.removeprefix(server.prefix)
+        if server.latency:
+            time.sleep(server.latency)
+
+        outcome = server.pick_outcome()
+        if outcome == 'rate_limited':
+            self.send_response(429)
+            self.send_header('Retry-After', str(server.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if outcome == 'failed':
+            self.send_error(500)
+            return
+
+        response = server.responses.get(endpoint)
+        if response is None:
+            self.send_error(404)
+            return
+
+        content, etag = response
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+    def log_message(self, format, *args):
+        pass # Requests are counted instead, see `StandIn.counts`
+
+
+class StandIn(ThreadingHTTPServer):
+    """Local server that answers like PokéAPI from a fixture `archive` (see `record`). Every request
+    waits `latency` seconds, and is then answered with 429 (and a `Retry-After` of `retry_after`
+    seconds) with probability `rate_limited`, or with 500 with probability `failures`. Outcomes are
+    drawn from a generator seeded with `seed`, so runs are repeatable.
+
+    URLs in the recorded responses are rewritten to point to this server. Its base URL is
+    `base_url`, and the number of requests answered with each outcome is kept in `counts`."""
+
+    daemon_threads = True
+
+    def __init__(self, archive: Path, host = '127.0.0.1', port = 0, latency = 0.0, rate_limited = 0.0, failures = 0.0, retry_after = 1, seed = 0):
+        super().__init__((host, port), Handler)
+        self.prefix = '/api/v2/'
+        self.base_url = f'http://{host}:{self.server_address[1]}{self.prefix}'
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.failures = failures
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.counts = {'ok': 0, 'rate_limited': 0, 'failed': 0}
+        self.lock = threading.Lock()
+
+        self.responses = {}
+        with zipfile.ZipFile(archive) as file:
+            recorded_url = json.loads(file.read(METADATA))['base_url'].encode()
+            for name in file.namelist():
+                if name != METADATA:
+                    content = file.read(name).replace(recorded_url, self.base_url.encode())
+                    self.responses[name] = (content, f'"{hashlib.sha256(content).hexdigest()}"')
+
+
+    def pick_outcome(self) -> str:
+        """Decides how the next request is answered, and counts it."""
+
+        with self.lock:
+            draw = self.random.random()
+            if draw < self.rate_limited:
+                outcome = 'rate_limited'
+            elif draw < self.rate_limited + self.failures:
+                outcome = 'failed'
+            else:
+                outcome = 'ok'
+            self.counts[outcome] += 1
+        return outcome
+
+
+    def start(self) -> 'StandIn':
+        """Serves requests from a background thread, until `shutdown` is called."""
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Records PokéAPI responses, or serves recorded ones.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='crawl PokéAPI and write every response to an archive')
+    record_parser.add_argument('archive', type=Path, nargs='?', default=FIXTURES / 'pokeapi.zip')
+    record_parser.add_argument('--limit', type=int, default=9999, help='species to crawl, as in get_data()')
+    record_parser.add_argument('--workers', type=int, help='concurrent requests')
+
+    serve_parser = subparsers.add_parser('serve', help='serve an archive as if it was PokéAPI')
+    serve_parser.add_argument('archive', type=Path, nargs='?', default=FIXTURES / 'pokeapi.zip')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8001)
+    serve_parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before every response')
+    serve_parser.add_argument('--rate-limited', type=float, default=0.0, help='probability of answering with 429')
+    serve_parser.add_argument('--failures', type=float, default=0.0, help='probability of answering with 500')
+    serve_parser.add_argument('--retry-after', type=int, default=1, help='seconds sent in the Retry-After header of 429 responses')
+    serve_parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        count = record(args.archive, args.limit, args.workers)
+        print(f'{count} endpoints recorded into {args.archive}')
+        return
+
+    server = StandIn(args.archive, args.host, args.port, args.latency, args.rate_limited, args.failures, args.retry_after, args.seed)
+    print(f'Serving {len(server.responses)} endpoints at {server.base_url} (set POKEAPI_URL to use it)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f'Requests answered: {server.counts}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Benchmarks for the calculations, the update pipeline and the HTTP endpoints, run against synthetic
+main resources of different sizes (see `synthetic.py`). PokéAPI is never called.
+
+Run it from the root of the project with:
+
+```bash
+poetry run python -m benchmarks.run --scales 1 10 100
+```
+
+With `--fixtures`, a crawl from scratch is also timed against a local stand-in of PokéAPI serving a
+recorded archive (see `pokeapi.py`), optionally with latency, 429 responses and server errors.
+
+Results are written to `benchmarks/results/<commit>.json` (or the `--output` path). Pass a previous
+results file to `--compare` to print how much each benchmark changed.
+"""
+
+
+import argparse, json, os, platform, subprocess, sys, tempfile
+from datetime import datetime, timezone
+from itertools import cycle
+from pathlib import Path
+from statistics import mean
+from time import perf_counter
+from unittest.mock import patch
+from src.utils.constants import TYPES
+from src.resources.dataset import Dataset
+from src.resources.calculations import CountMatrix, TypeIndex, get_balance, get_balances, get_diversity, get_diversities, get_total_type_weight, get_types_count, get_typings, get_weight_table
+from benchmarks.synthetic import GENS, make_source
+from benchmarks.pokeapi import StandIn
+
+RESULTS = Path(__file__).parent / 'results'
+LOCAL_TYPES = [type for type in TYPES if type not in ('unknown', 'stellar')]
+ROUTES = [
+    '/types/fire',
+    '/types/fire/accumulated',
+    '/generations/5/partial',
+    '/generations/5/partial/accumulated',
+    '/generations/5/strict',
+    '/generations/5/strict/accumulated',
+    '/generations?mode=partial&accumulated=1',
+    '/types?names=fire,water&format=ndjson',
+    '/generations/5/pokemon?types=fire,water&accumulated=1',
+    '/stats/timeseries?mode=strict&accumulated=1',
+    '/query?gens=3-5&mode=strict&types=fire/flying,water',
+    ]
+
+
+def measure(function, min_runs = 3, min_seconds = 0.2) -> dict:
+    """Calls `function` until it has run at least `min_runs` times and for `min_seconds`, and returns
+    timing statistics in milliseconds."""
+
+    times = []
+    start = perf_counter()
+    while len(times) < min_runs or perf_counter() - start < min_seconds:
+        call_start = perf_counter()
+        function()
+        times.append((perf_counter() - call_start) * 1000)
+
+    return {'runs': len(times), 'mean_ms': mean(times), 'min_ms': min(times)}
+
+
+def bench_calculations(source: list[dict]) -> dict:
+    """Times the counting functions, with the reference implementations, the `CountMatrix` and the
+    `TypeIndex`, and the statistic indexes."""
+
+    dataset = Dataset(source, GENS)
+    matrix = CountMatrix(dataset)
+    index = TypeIndex(dataset)
+    weights = [matrix.weight(5, type, accumulated = True) for type in LOCAL_TYPES]
+    _, table = get_weight_table(matrix, LOCAL_TYPES, 1, GENS, accumulated = True)
+    strict_weights = [matrix.count(5, *typing, accumulated = True) for typing in get_typings(LOCAL_TYPES, 5)]
+
+    return {
+        'get_types_count_partial': measure(lambda: get_types_count(dataset, 5, 'fire', partial = True, accumulated = True)),
+        'get_types_count_strict': measure(lambda: get_types_count(dataset, 5, 'fire', 'flying', accumulated = True)),
+        'get_total_type_weight': measure(lambda: get_total_type_weight(dataset, 5, 'fire', accumulated = True)),
+        'dataset_build': measure(lambda: Dataset(source, GENS)),
+        'count_matrix_build': measure(lambda: CountMatrix(dataset)),
+        'count_matrix_count': measure(lambda: matrix.count(5, 'fire', 'flying', accumulated = True)),
+        'type_index_build': measure(lambda: TypeIndex(dataset)),
+        'type_index_count': measure(lambda: index.count(5, 'fire', 'flying', accumulated = True)),
+        'get_balance_partial': measure(lambda: get_balance(weights)),
+        'get_diversity_partial': measure(lambda: get_diversity(weights)),
+        'get_balance_strict': measure(lambda: get_balance(strict_weights)),
+        'get_diversity_strict': measure(lambda: get_diversity(strict_weights)),
+        'get_balances_all_gens_strict': measure(lambda: get_balances(table)),
+        'get_diversities_all_gens_strict': measure(lambda: get_diversities(table)),
+        }
+
+
+def stub_network(source: list[dict], directory: Path) -> list:
+    """Returns patches that make `update` work from the given `source` and write its resources into
+    `directory`, without any request to PokéAPI."""
+
+    listings = {'generation': {'count': GENS}, 'type': {'results': [{'name': type} for type in TYPES]}}
+    return [
+        patch('src.resources.updater.is_source_ok', return_value=True),
+        patch('src.resources.updater.read_source', return_value=source),
+        patch('src.resources.updater.refresh_data', return_value=(source, False)),
+        patch('src.resources.updater.call', side_effect=lambda endpoint, **kwargs: listings[endpoint]),
+        patch('src.utils.snapshots.SNAPSHOTS', directory / 'snapshots'),
+        ]
+
+
+def bench_update(workers: int) -> dict:
+    """Times a full `update`, which must be run with the network stubbed out (see `stub_network`)."""
+
+    from src.resources.updater import update
+    return {f'update_{workers}_workers': measure(lambda: update(incremental = False, workers = workers, force = True), min_runs = 1, min_seconds = 0)}
+
+
+def bench_incremental_build(source: list[dict]) -> dict:
+    """Times a build after the types of a single entry changed, which only creates the resources
+    that entry affects again. It must be run after `bench_update`, so there's a snapshot to reuse."""
+
+    from src.resources.updater import build
+    changed = list(source) # Only the changed entry is a new object, as after `refresh_data`
+    changed[0] = dict(source[0], types={gen_name: ['dragon'] for gen_name in source[0]['types']})
+    versions = cycle([changed, source]) # Every run changes the entry back and forth
+
+    def run():
+        version = next(versions)
+        build(CountMatrix(Dataset(version, GENS)), LOCAL_TYPES, source = version)
+
+    return {'build_one_entry_changed': measure(run, min_runs = 2, min_seconds = 0)}
+
+
+def bench_crawl(archive: Path, workers: int, fetch_rate: float, **faults) -> dict:
+    """Times `get_data` crawling the whole Pokédex from a `StandIn` that serves the `archive`, with
+    the given `faults` (`latency`, `rate_limited`, `failures`). The HTTP cache is bypassed, and
+    requests are limited to `fetch_rate` per second."""
+
+    from src.resources import fetcher
+    server = StandIn(archive, retry_after = 0, **faults).start()
+    try:
+        with patch.object(fetcher, 'base_url', server.base_url), patch.object(fetcher, 'cache', None), patch.object(fetcher, 'limiter', fetcher.RateLimiter(fetch_rate)):
+            result = measure(lambda: fetcher.get_data(9999, workers), min_runs = 1, min_seconds = 0)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    result['requests'] = sum(server.counts.values())
+    result['injected_faults'] = server.counts['rate_limited'] + server.counts['failed']
+    return {f'crawl_{workers}_workers': result}
+
+
+def bench_routes(client, requests = 200) -> dict:
+    """Measures the throughput of every route in `ROUTES`, in requests per second."""
+
+    results = {}
+    for route in ROUTES:
+        response = client.get(route)
+        if response.status_code != 200:
+            raise RuntimeError(f'{route} answered with status {response.status_code}.')
+
+        start = perf_counter()
+        for _ in range(requests):
+            client.get(route)
+        seconds = perf_counter() - start
+        results[f'route {route}'] = {'runs': requests, 'mean_ms': seconds / requests * 1000, 'requests_per_second': requests / seconds}
+
+    return results
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results: dict, previous: dict):
+    """Prints the change of every benchmark's mean time between a `previous` run and this one."""
+
+    groups = [(f'{scale}x', benchmarks, previous['scales'].get(scale, {})) for scale, benchmarks in results['scales'].items()]
+    groups.append(('crawl', results.get('crawl', {}), previous.get('crawl', {})))
+
+    for label, benchmarks, old_benchmarks in groups:
+        for name, result in benchmarks.items():
+            old = old_benchmarks.get(name)
+            if old:
+                change = (result['mean_ms'] / old['mean_ms'] - 1) * 100
+                print(f'{label} {name}: {old["mean_ms"]:.3f} ms -> {result["mean_ms"]:.3f} ms ({change:+.1f}%)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks Pokeback with synthetic data.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help='sizes of the synthetic sources, relative to the real one')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4], help='worker counts to run update() with')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--output', type=Path, help='where to write the results (JSON)')
+    parser.add_argument('--compare', type=Path, help='a previous results file to compare with')
+    parser.add_argument('--fixtures', type=Path, help='a PokéAPI archive (see pokeapi.py) to time a crawl against')
+    parser.add_argument('--fetch-rate', type=float, default=1e6, help='requests per second allowed during the crawl')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the stand-in waits before every response')
+    parser.add_argument('--rate-limited', type=float, default=0.0, help='probability of the stand-in answering with 429')
+    parser.add_argument('--failures', type=float, default=0.0, help='probability of the stand-in answering with 500')
+    args = parser.parse_args()
+
+    results = {'commit': get_commit(),
+               'date': datetime.now(timezone.utc).isoformat(),
+               'python': platform.python_version(),
+               'scales': {}}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales:
+            print(f'Running benchmarks at {scale}x scale...', file=sys.stderr)
+            source = make_source(scale)
+            scale_results = bench_calculations(source)
+
+            patches = stub_network(source, Path(directory))
+            for stub in patches:
+                stub.start()
+            try:
+                for workers in args.workers:
+                    scale_results.update(bench_update(workers))
+                scale_results.update(bench_incremental_build(source))
+
+                os.environ['FAST_START'] = '0' # Resources must be ready before requests are measured
+                from src.app import app # Importing the app runs update(), which is stubbed by now
+                scale_results.update(bench_routes(app.test_client(), args.requests))
+            finally:
+                for stub in patches:
+                    stub.stop()
+
+            results['scales'][str(scale)] = scale_results
+
+    if args.fixtures:
+        print(f'Running crawl benchmarks against {args.fixtures}...', file=sys.stderr)
+        results['crawl'] = {}
+        for workers in args.workers:
+            results['crawl'].update(bench_crawl(args.fixtures, workers, args.fetch_rate, latency = args.latency, rate_limited = args.rate_limited, failures = args.failures))
+
+    output = args.output or RESULTS / f'{results["commit"]}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'Results written to {output}', file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Synthetic versions of the main resource, with the same schema as `source.json` but any size."""
+
+
+import random
+from src.utils.constants import TYPES
+
+BASE_SIZE = 600 # Roughly the size of the real main resource
+GENS = 9
+TYPE_INTRODUCTION = {'steel': 2, 'dark': 2, 'fairy': 6} # Types that didn't exist since gen 1
+
+
+def random_typing(rng: random.Random, gen_num: int) -> list[str]:
+    """Returns a random typing made of types that exist at the given generation."""
+
+    available = [type for type in TYPES if type not in ('unknown', 'stellar') and TYPE_INTRODUCTION.get(type, 1) <= gen_num]
+    return rng.sample(available, 1 if rng.random() < 0.4 else 2)
+
+
+def make_source(scale = 1, gens = GENS, seed = 0) -> list[dict]:
+    """Returns a list of `BASE_SIZE * scale` entries shaped like the ones returned by `get_data`.
+    The same `scale` and `seed` always give the same list.
+
+    Roughly, 2% of the entries are region-only, 5% evolve in a later generation, and 10% change
+    their typing at some point (like the Pokémon that became fairy type at gen 6)."""
+
+    rng = random.Random(seed)
+    source = []
+
+    for number in range(1, BASE_SIZE * scale + 1):
+        gen = rng.randint(1, gens)
+        typing = random_typing(rng, gen)
+        changes_at = rng.randint(gen + 1, gens) if gen < gens and rng.random() < 0.1 else None
+        new_typing = random_typing(rng, changes_at) if changes_at else None
+
+        types = {}
+        for gen_num in range(1, gens + 1):
+            types[f'gen_{gen_num}'] = new_typing if changes_at and gen_num >= changes_at else typing
+
+        evolves_at = rng.randint(gen + 1, gens) if gen < gens and rng.random() < 0.05 else 999
+        source.append({'name': f'synthetic-{number}',
+                       'gen': gen,
+                       'national_dex_num': number,
+                       'types': types,
+                       'region_only': gen >= 7 and rng.random() < 0.02,
+                       'evolves_at': evolves_at})
+
+    return source
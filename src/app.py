@@ -1,27 +1,150 @@
-import os, logging
+import os, json, hashlib, logging
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request, abort, send_file
-from src.resources.updater import update, auto_update
-from src.utils.paths import SRC, TYPES, GENERATIONS
-from src.utils.manage_json import read_json
+from time import perf_counter, monotonic
+from flask import Flask, Response, g, jsonify, request, abort, send_file, url_for
+from src.resources.updater import auto_update
+from src.resources.jobs import updates
+from src.resources.resource_cache import resources
+from src.resources.query import queries, parse_gens
+from src.utils.paths import LOGFILE, LEADER_LOCK
+from src.utils.logs import CompressingRotatingFileHandler, get_events, tail
+from src.utils.leader import Leader
+from src.utils.metrics import metrics
+from src.utils.snapshots import get_current_version, get_previous_version, get_versions, publish
 
 load_dotenv()
 env = os.getenv('ENV', 'development')
 is_dev = env == 'development'
 admin_key = os.getenv('ADMIN_KEY')
+fast_start = os.getenv('FAST_START', '1') == '1' # Serve existing resources while updating in the background
+cache_max_age = int(os.getenv('CACHE_MAX_AGE', 3600)) # Seconds clients may reuse a resource without revalidating it
+sync_interval = float(os.getenv('SYNC_INTERVAL', 1)) # Seconds between checks for snapshots published by other processes
+
+leader = Leader(LEADER_LOCK) # When served by many processes, only the leader updates resources. See `follow_leader`
+next_sync = 0.0
 
 logging.basicConfig(
-    filename = SRC / 'app.log',
-    filemode = 'a',
+    handlers = [CompressingRotatingFileHandler(LOGFILE, rotates=lambda: leader.is_leader)], # Appends, and only the leader rotates the file when it grows too large
     level = logging.INFO,
     format = '%(asctime)s - %(levelname)s: %(message)s (At %(name)s)'
     )
+logger = logging.getLogger(__name__)
+
+
+def lead():
+    """Schedules updates, runs those requested by other processes, and starts one right away. Only
+    the leader does this."""
+    auto_update(lambda: updates.submit('scheduled'))
+    updates.watch(sync_interval)
+    return updates.submit('startup')
 
-auto_update()
-update()
+
+resources.reload() # Existing resources can be served right away
+if leader.acquire():
+    startup_job = lead()
+    if not fast_start:
+        startup_job.wait()
 
 app = Flask(__name__)
 
+ENCODINGS = ['br', 'gzip', 'identity'] # Preferred first, when clients accept several equally
+
+
+@app.before_request
+def start_timer():
+    g.start = perf_counter()
+
+
+@app.before_request
+def follow_leader():
+    """Loads snapshots published by other processes (such as the leader, after an update) every
+    `sync_interval` seconds, and takes the leadership if the leader is gone. Resources are read from
+    the same memory-mapped pack by every process, so memory doesn't grow with their number."""
+    global next_sync
+    if monotonic() < next_sync:
+        return
+    next_sync = monotonic() + sync_interval
+
+    if not leader.is_leader and leader.acquire():
+        logger.info('The previous leader is gone. Taking over updates.')
+        lead()
+    if resources.reload() and queries.matrix is not None:
+        queries.reload() # The main resource was updated along with the snapshot
+
+
+@app.after_request
+def record_latency(response: Response) -> Response:
+    """Records the latency of every request, labelled by route (not by full path, to keep the number
+    of series small)."""
+    if 'start' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('pokeback_request_duration_seconds', perf_counter() - g.start, route=route, method=request.method, status=response.status_code)
+    return response
+
+
+def require_admin():
+    """Aborts the request unless it carries the admin key."""
+    received_key = request.headers.get('Authorization')
+    if received_key != f'Bearer {admin_key}':
+        abort(403)
+
+
+def serve_resource(name: str) -> Response:
+    """Returns the cached resource of the given `name`, precompressed in the best content coding the
+    client accepts, and answers with 304 if the client already has it (see the `If-None-Match`
+    header)."""
+    accepted = [encoding for encoding in ENCODINGS if encoding == 'identity' or request.accept_encodings[encoding]]
+    accepted.sort(key=lambda encoding: -request.accept_encodings[encoding]) # Stable, so equally accepted codings keep our preference
+    resource = resources.get(name, accepted)
+    if resource is None:
+        abort(404)
+
+    body, encoding, etag = resource
+
+    response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if encoding != 'identity':
+        response.content_encoding = encoding
+        etag = f'{etag}-{encoding}' # Each representation needs its own strong ETag
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = cache_max_age
+    return response.make_conditional(request)
+
+
+def serve_batch(names: dict[str, str]) -> Response:
+    """Returns many cached resources in a single response, given as a key: resource name mapping.
+    The body is a JSON object of every key and resource, or one `{"name": key, "resource": ...}` line
+    per resource if `format=ndjson`. Either way, it's assembled from the cached bytes without
+    decoding them."""
+    format = request.args.get('format', 'json')
+    if format not in ('json', 'ndjson'):
+        abort(400, description=f'Invalid format "{format}". Expected "json" or "ndjson".')
+
+    chunks = []
+    etags = [format]
+    for key, name in names.items():
+        resource = resources.get(name)
+        if resource is None:
+            abort(404, description=f'Resource "{key}" not found.')
+        body, _, etag = resource
+        key = json.dumps(key).encode()
+        if format == 'json':
+            chunks += [b',' if chunks else b'{', key, b':', body]
+        else:
+            chunks += [b'{"name":', key, b',"resource":', body, b'}\n']
+        etags.append(etag)
+    if format == 'json':
+        chunks.append(b'}' if chunks else b'{}')
+
+    mimetype = 'application/json' if format == 'json' else 'application/x-ndjson'
+    response = Response(b''.join(chunks), mimetype=mimetype) # A single bytes body, which every WSGI server accepts
+    response.set_etag(hashlib.sha256(' '.join(etags).encode()).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = cache_max_age
+    return response.make_conditional(request)
+
+
 @app.route('/')
 def index():
     info = {'info': 'App running'}
@@ -29,51 +152,210 @@ def index():
     return jsonify(info)
 
 
+@app.route('/health/ready')
+def get_readiness():
+    """Tells load balancers whether resources are loaded, so traffic is only sent once they are."""
+    if not resources.is_ready():
+        return jsonify({'ready': False}), 503
+    return jsonify({'ready': True})
+
+
 @app.route('/update', methods=['PUT'])
 def manual_update():
-    received_key = request.headers.get('Authorization')
-    if received_key != f'Bearer {admin_key}':
-        abort(403)
+    """Starts an update in the background, or joins the one already running, and returns its job.
+    Only the leader process runs updates, so other ones request it from the leader (which may be a
+    process that serves no requests, such as the master of a preloading server)."""
+    require_admin()
+    if leader.is_leader:
+        job = updates.submit('manual').to_dict()
+    else:
+        job = updates.request('manual')
+    return jsonify(job), 202, {'Location': url_for('get_update_job', job_id=job['id'])}
 
-    update()
-    info = {'Info': 'Resources updated'}
-    return jsonify(info)
+
+@app.route('/update/<job_id>')
+def get_update_job(job_id):
+    """Returns an update job, as recorded by whichever process runs it."""
+    require_admin()
+    job = updates.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+
+@app.route('/snapshots')
+def get_snapshots():
+    require_admin()
+    return jsonify({'current': get_current_version(), 'versions': get_versions()})
+
+
+@app.route('/snapshots/<version>', methods=['PUT'])
+@app.route('/rollback', methods=['PUT'])
+def activate_snapshot(version = None):
+    """Publishes an existing snapshot, which is the previous one for `/rollback`."""
+    require_admin()
+    version = version or get_previous_version()
+    try:
+        publish(version)
+    except ValueError as error:
+        abort(404, description=str(error))
+
+    if resources.reload():
+        queries.reload() # From the main resource stored with the snapshot, so queries match it
+    return jsonify({'current': get_current_version(), 'versions': get_versions()})
+
+
+@app.route('/types')
+def get_types():
+    """Returns many type resources at once (see `serve_batch`): those in `names` (comma-separated),
+    or all of them."""
+    suffix = '_accumulated' if request.args.get('accumulated', '0') in ('1', 'true') else ''
+    names = request.args.get('names')
+    if names:
+        names = [name.strip().lower() for name in names.split(',')]
+    else:
+        names = [name.removeprefix('types/') for name in resources.names() if name.startswith('types/') and not name.endswith('_accumulated')]
+
+    return serve_batch({name: f'types/{name}{suffix}' for name in names})
 
 
 @app.route('/types/<name>')
 @app.route('/types/<name>/accumulated')
 def get_type(name):
     suffix = '_accumulated' if request.path.endswith('accumulated') else ''
-    resource = read_json(TYPES / f'{name}{suffix}.json')
-    return jsonify(resource)
+    return serve_resource(f'types/{name}{suffix}')
+
+
+@app.route('/generations')
+def get_generations():
+    """Returns many generation resources at once (see `serve_batch`): those of the given `mode`
+    (both if not given) within the `gens` range (all if not given)."""
+    mode = request.args.get('mode')
+    if mode not in (None, 'partial', 'strict'):
+        abort(400, description=f'Invalid mode "{mode}". Expected "partial" or "strict".')
+    modes = [mode] if mode else ['partial', 'strict']
+    suffix = '_accumulated' if request.args.get('accumulated', '0') in ('1', 'true') else ''
+
+    gens = sum(1 for name in resources.names() if name.startswith('generations/') and name.endswith('_partial'))
+    try:
+        first, last = parse_gens(request.args.get('gens'), gens)
+    except ValueError as error:
+        abort(400, description=str(error))
+
+    names = {}
+    for gen_num in range(first, last + 1):
+        for mode in modes:
+            name = f'gen_{gen_num}_{mode}{suffix}'
+            names[name] = f'generations/{name}'
+    return serve_batch(names)
 
 
 @app.route('/generations/<int:number>/partial')
 @app.route('/generations/<int:number>/partial/accumulated')
 def get_generation_monotypes(number):
     suffix = '_accumulated' if request.path.endswith('accumulated') else ''
-    resource = read_json(GENERATIONS / f'gen_{number}_partial{suffix}.json')
-    return jsonify(resource)
+    return serve_resource(f'generations/gen_{number}_partial{suffix}')
 
 
 @app.route('/generations/<int:number>/strict')
 @app.route('/generations/<int:number>/strict/accumulated')
 def get_generation_duals(number):
     suffix = '_accumulated' if request.path.endswith('accumulated') else ''
-    resource = read_json(GENERATIONS / f'gen_{number}_strict{suffix}.json')
-    return jsonify(resource)
+    return serve_resource(f'generations/gen_{number}_strict{suffix}')
+
+
+@app.route('/generations/<int:number>/pokemon')
+def get_generation_members(number):
+    """Lists the Pokémon behind the counts of a generation, for the given `types` (every typing if
+    not given). See `QueryEngine.members`."""
+    mode = request.args.get('mode', 'partial')
+    if mode not in ('partial', 'strict'):
+        abort(400, description=f'Invalid mode "{mode}". Expected "partial" or "strict".')
+
+    try:
+        result = queries.members(
+            gen_num = number,
+            typings = request.args.get('types'),
+            partial = mode == 'partial',
+            accumulated = request.args.get('accumulated', '0') in ('1', 'true')
+            )
+    except ValueError as error:
+        abort(400, description=str(error))
+
+    return jsonify(result)
+
+
+@app.route('/query')
+def get_query():
+    """Computes statistics for any range of generations and set of typings. See `QueryEngine`."""
+    mode = request.args.get('mode', 'partial')
+    if mode not in ('partial', 'strict'):
+        abort(400, description=f'Invalid mode "{mode}". Expected "partial" or "strict".')
+
+    try:
+        result = queries.query(
+            gens = request.args.get('gens'),
+            typings = request.args.get('types'),
+            partial = mode == 'partial',
+            accumulated = request.args.get('accumulated', '0') in ('1', 'true')
+            )
+    except ValueError as error:
+        abort(400, description=str(error))
+
+    return jsonify(result)
+
+
+@app.route('/stats/timeseries')
+def get_stats_timeseries():
+    """Returns the weights, balance and diversity of every generation in a range, for trend charts.
+    See `QueryEngine.timeseries`."""
+    mode = request.args.get('mode', 'partial')
+    if mode not in ('partial', 'strict'):
+        abort(400, description=f'Invalid mode "{mode}". Expected "partial" or "strict".')
+
+    try:
+        result = queries.timeseries(
+            gens = request.args.get('gens'),
+            partial = mode == 'partial',
+            accumulated = request.args.get('accumulated', '0') in ('1', 'true')
+            )
+    except ValueError as error:
+        abort(400, description=str(error))
+
+    return jsonify(result)
+
+
+@app.route('/query/stats')
+def get_query_stats():
+    return jsonify(queries.stats())
+
+
+@app.route('/metrics')
+def get_metrics():
+    require_admin()
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/logs')
 def get_log():
-    log_file = SRC / 'app.log'
-    received_key = request.headers.get('Authorization')
-    if received_key != f'Bearer {admin_key}':
-        abort(403)
-    if not log_file.exists():
+    """Returns the log file, in parts if the `Range` header asks for them. With `tail=N`, it returns
+    only its last N lines instead, and with `follow=1` (or when asked for `text/event-stream`) it
+    streams new lines as server-sent events, starting with the last `tail` ones."""
+    require_admin()
+    if not LOGFILE.exists():
         abort(404)
 
-    return send_file(log_file, mimetype="text/plain", as_attachment=True)
+    try:
+        lines = int(request.args.get('tail', 0))
+    except ValueError:
+        abort(400, description='Invalid "tail" value. Expected a number of lines.')
+
+    if request.args.get('follow', '0') in ('1', 'true') or request.accept_mimetypes.best == 'text/event-stream':
+        return Response(get_events(LOGFILE, lines), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    if lines:
+        return Response(tail(LOGFILE, lines), mimetype='text/plain')
+
+    return send_file(LOGFILE, mimetype="text/plain", as_attachment=True, conditional=True) # Sent in chunks, with support for Range requests
 
 
 if __name__ == '__main__':
@@ -1,8 +1,11 @@
+from array import array
+from itertools import combinations
 from math import log10
+from operator import mul
+from src.resources.dataset import Dataset
 
-def get_types_count(source: dict, gen_num: int, *types: str, partial = False, accumulated = False):
-    """Counts how many Pokémon in the `source` dictionary have the specified types. The dict should
-    be a "gen" resource.
+def get_types_count(dataset: Dataset, gen_num: int, *types: str, partial = False, accumulated = False):
+    """Counts how many Pokémon in the `dataset` have the specified types.
 
     If `partial` is set to `True`, `types` should be a single string value and Pokémon whose typing
     contains that type will be counted. Otherwise, `types` should be 1 or 2 string arguments and
@@ -14,22 +17,21 @@ def get_types_count(source: dict, gen_num: int, *types: str, partial = False, ac
     if (partial and len(types) != 1) or (not partial and len(types) > 2):
         raise ValueError(f'Wrong number of arguments for the "types" parameter. Expected {1 if partial else 2}, received {len(types)}.')
 
-    gen_name = f'gen_{gen_num}'
-
     count = 0
-    for pokemon in source:
+    for row in range(len(dataset)):
+        typing = dataset.typing(row, gen_num)
         if partial:
-            counted = types[0] in pokemon['types'][gen_name]
+            counted = types[0] in typing
         else:
-            counted = sorted(pokemon['types'][gen_name]) == sorted(types) # This line also allows for tuple usage when passing types, since sorted() returns lists
+            counted = sorted(typing) == sorted(types) # This line also allows for tuple usage when passing types, since sorted() returns lists
 
-        outdated = pokemon['evolves_at'] <= gen_num # Checking if new evolutions exist by this gen
+        outdated = dataset.evolves_at[row] <= gen_num # Checking if new evolutions exist by this gen
 
         if counted and not outdated:
 
-            exists = pokemon['gen'] <= gen_num
-            from_this_gen = pokemon['gen'] == gen_num
-            region_only = pokemon['region_only']
+            exists = dataset.gen[row] <= gen_num
+            from_this_gen = dataset.gen[row] == gen_num
+            region_only = dataset.region_only[row]
             available = (exists and not region_only) or from_this_gen # If Pokémon is region-only (Perrserker, for example), it's only available in case we are "playing" in the generation it's from. See METHODS.md for more info.
 
             if not accumulated and from_this_gen:
@@ -40,23 +42,21 @@ def get_types_count(source: dict, gen_num: int, *types: str, partial = False, ac
     return count
 
 
-def get_total_type_weight(source: dict, gen_num: int, type: str, accumulated = False):
+def get_total_type_weight(dataset: Dataset, gen_num: int, type: str, accumulated = False):
     """Returns the total weight of a `type` in the generation of the given `gen_num`, by reading a
-    `source` dictionary obtained from a generation JSON resource. Each available Pokémon of said
-    type has a weight of 1 if it's mono-type or 0,5 if it has two types. This function returns the
-    sum of all weights.
+    `dataset`. Each available Pokémon of said type has a weight of 1 if it's mono-type or 0,5 if it
+    has two types. This function returns the sum of all weights.
 
     If `accumulated` is set to `False`, Pokémon are counted only if they belong to the generation of
     the specified `gen_num`. Otherwise, they are also counted if they existed prior to that gen."""
 
-    gen_name = f'gen_{gen_num}'
     weight = 0.0
-    for pokemon in source:
-        typing = pokemon['types'][gen_name]
+    for row in range(len(dataset)):
+        typing = dataset.typing(row, gen_num)
         if type in typing:
-            exists = pokemon['gen'] <= gen_num
-            from_this_gen = pokemon['gen'] == gen_num
-            region_only = pokemon['region_only']
+            exists = dataset.gen[row] <= gen_num
+            from_this_gen = dataset.gen[row] == gen_num
+            region_only = dataset.region_only[row]
             available = (exists and not region_only) or from_this_gen # If Pokémon is region-only (Perrserker, for example), it's only available in case we are "playing" in the generation it's from. See METHODS.md for more info.
 
             if (accumulated and available) or from_this_gen:
@@ -66,6 +66,225 @@ def get_total_type_weight(source: dict, gen_num: int, type: str, accumulated = F
     return weight
 
 
+def get_typings(types: list[str], gen_num: int, partial = False) -> list[tuple[str, ...]]:
+    """Returns the typings that exist at the generation of the given `gen_num`, as tuples of one or
+    two of the given `types`. If `partial` is set to `True`, only single types are returned.
+    Otherwise, every dual typing is returned first, followed by every single one."""
+
+    adjusted_types = types.copy()
+    if gen_num < 6:
+        adjusted_types.remove('fairy')
+    if gen_num < 2:
+        adjusted_types.remove('steel')
+        adjusted_types.remove('dark')
+
+    duals = list(combinations(adjusted_types, 2))
+    all_typings = duals + [(type, ) for type in adjusted_types] # Normalize typing format
+    return [(type, ) for type in adjusted_types] if partial else all_typings
+
+
+class CountMatrix:
+    """Generation × typing × mode tensor holding every count and weight that `get_types_count` and
+    `get_total_type_weight` can return for a `dataset`, filled with a single pass over it.
+
+    Typings are stored as sorted tuples, so `('fire', 'flying')` and `('flying', 'fire')` share a
+    column. Counts are kept for the 4 combinations of `partial` and `accumulated`, and weights for
+    both values of `accumulated`. Typings that never appear in the dataset count as 0."""
+
+    COUNT_MODES = 4 # (partial, accumulated) pairs
+    WEIGHT_MODES = 2 # accumulated or not
+
+    def __init__(self, dataset: Dataset):
+        gens = self.gens = dataset.gens
+        self.columns = {} # Sorted typing -> column index
+        self.counts = array('l')
+        self.weights = array('d')
+
+        layouts = [] # Typing id -> positions of its types and of itself at gen 1, and weight of each type
+        for typing in dataset.typing_names:
+            type_bases = [self._index(self._column((type, )), 1) for type in typing]
+            layouts.append((type_bases, self._index(self._column(tuple(sorted(typing))), 1), 1.0 if len(typing) == 1 else 0.5))
+
+        counts = self.counts
+        weights = self.weights
+        typing_codes = dataset.typing_codes
+
+        for row, gen in enumerate(dataset.gen):
+            evolves_at = dataset.evolves_at[row]
+            last_gen = gen if dataset.region_only[row] else gens # See get_types_count
+
+            for gen_num in range(gen, last_gen + 1): # Pokémon aren't available before their gen, so nothing is added there
+                type_bases, typing_base, fraction = layouts[typing_codes[gen_num - 1][row]]
+
+                offset = (gen_num - 1) * self.COUNT_MODES
+                from_this_gen = gen == gen_num
+                counted = evolves_at > gen_num # Outdated Pokémon add weight, but aren't counted
+
+                for base in type_bases:
+                    base += offset
+                    weights[base // 2 + 1] += fraction
+                    if from_this_gen:
+                        weights[base // 2] += fraction
+                    if counted:
+                        counts[base + 3] += 1
+                        if from_this_gen:
+                            counts[base + 2] += 1
+
+                if counted:
+                    base = typing_base + offset
+                    counts[base + 1] += 1
+                    if from_this_gen:
+                        counts[base] += 1
+
+
+    def _column(self, typing: tuple) -> int:
+        """Returns the column of a sorted `typing`, allocating it if it's new."""
+        column = self.columns.get(typing)
+        if column is None:
+            column = len(self.columns)
+            self.columns[typing] = column
+            self.counts.extend([0] * self.gens * self.COUNT_MODES)
+            self.weights.extend([0.0] * self.gens * self.WEIGHT_MODES)
+        return column
+
+
+    def _index(self, column: int, gen_num: int) -> int:
+        """Returns the position of the first count mode for a `column` at the given `gen_num`. Weights
+        for the same cell start at half that position."""
+        return (column * self.gens + gen_num - 1) * self.COUNT_MODES
+
+
+    def count(self, gen_num: int, *types: str, partial = False, accumulated = False) -> int:
+        """Same as `get_types_count`, but read from the matrix instead of the dataset."""
+
+        if (partial and len(types) != 1) or (not partial and len(types) > 2):
+            raise ValueError(f'Wrong number of arguments for the "types" parameter. Expected {1 if partial else 2}, received {len(types)}.')
+        if not 1 <= gen_num <= self.gens:
+            raise ValueError(f'Generation {gen_num} is out of range. Expected 1 to {self.gens}.')
+
+        column = self.columns.get(tuple(sorted(types)))
+        if column is None:
+            return 0
+
+        mode = 2 * partial + accumulated
+        return self.counts[self._index(column, gen_num) + mode]
+
+
+    def weight(self, gen_num: int, type: str, accumulated = False) -> float:
+        """Same as `get_total_type_weight`, but read from the matrix instead of the dataset."""
+
+        if not 1 <= gen_num <= self.gens:
+            raise ValueError(f'Generation {gen_num} is out of range. Expected 1 to {self.gens}.')
+
+        column = self.columns.get((type, ))
+        if column is None:
+            return 0.0
+
+        return self.weights[self._index(column, gen_num) // 2 + accumulated]
+
+
+class TypeIndex:
+    """Inverted index of a `dataset`: for every generation, the Pokémon having each type, stored as
+    bitsets (Python ints whose bit `i` stands for row `i` of the dataset), along with masks for the
+    conditions used by `get_types_count`. Counts and weights are popcounts of ANDed masks, and the
+    Pokémon behind them can be listed with `names`."""
+
+    def __init__(self, dataset: Dataset):
+        gens = self.gens = dataset.gens
+        self.rows = dataset.names
+        self.types = [{} for _ in range(gens)] # Per gen: type -> Pokémon having it
+        self.monotypes = [0] * gens # Pokémon with a single type
+        self.exists = [0] * gens # Pokémon from this gen or a prior one
+        self.from_this_gen = [0] * gens
+        self.outdated = [0] * gens # Pokémon with new evolutions by this gen
+        self.region_only = 0 # Not gen-dependent
+
+        outdated_at = [0] * gens # Pokémon that become outdated exactly at each gen
+        for row, gen in enumerate(dataset.gen):
+            bit = 1 << row
+            self.from_this_gen[gen - 1] |= bit
+            if dataset.evolves_at[row] <= gens:
+                outdated_at[dataset.evolves_at[row] - 1] |= bit
+            if dataset.region_only[row]:
+                self.region_only |= bit
+
+        exists = outdated = 0
+        for i, codes in enumerate(dataset.typing_codes):
+            exists |= self.from_this_gen[i]
+            outdated |= outdated_at[i]
+            self.exists[i] = exists
+            self.outdated[i] = outdated
+
+            typings = {} # Typing id -> Pokémon having it
+            for row, code in enumerate(codes):
+                typings[code] = typings.get(code, 0) | 1 << row
+            types = self.types[i]
+            for code, bitset in typings.items():
+                type_ids = dataset.typings[code]
+                for type_id in type_ids:
+                    type = dataset.type_names[type_id]
+                    types[type] = types.get(type, 0) | bitset
+                if len(type_ids) == 1:
+                    self.monotypes[i] |= bitset
+
+
+    def available(self, gen_num: int, accumulated = False) -> int:
+        """Returns the Pokémon that are counted at the given `gen_num`, ignoring their types (see
+        `get_types_count`)."""
+
+        i = gen_num - 1
+        if not accumulated:
+            return self.from_this_gen[i]
+        return (self.exists[i] & ~self.region_only) | self.from_this_gen[i]
+
+
+    def members(self, gen_num: int, *types: str, partial = False, accumulated = False) -> int:
+        """Returns the bitset of the Pokémon counted by `get_types_count` with the same arguments."""
+
+        if (partial and len(types) != 1) or (not partial and len(types) > 2):
+            raise ValueError(f'Wrong number of arguments for the "types" parameter. Expected {1 if partial else 2}, received {len(types)}.')
+        if not 1 <= gen_num <= self.gens:
+            raise ValueError(f'Generation {gen_num} is out of range. Expected 1 to {self.gens}.')
+        if not types:
+            return 0
+
+        i = gen_num - 1
+        bitset = self.available(gen_num, accumulated) & ~self.outdated[i]
+        for type in types:
+            bitset &= self.types[i].get(type, 0)
+        if not partial:
+            bitset &= self.monotypes[i] if len(set(types)) == 1 else ~self.monotypes[i] # Exactly that typing
+        return bitset
+
+
+    def count(self, gen_num: int, *types: str, partial = False, accumulated = False) -> int:
+        """Same as `get_types_count`, but read from the index instead of the dataset."""
+        return self.members(gen_num, *types, partial = partial, accumulated = accumulated).bit_count()
+
+
+    def weight(self, gen_num: int, type: str, accumulated = False) -> float:
+        """Same as `get_total_type_weight`, but read from the index instead of the dataset."""
+
+        if not 1 <= gen_num <= self.gens:
+            raise ValueError(f'Generation {gen_num} is out of range. Expected 1 to {self.gens}.')
+
+        i = gen_num - 1
+        bitset = self.types[i].get(type, 0) & self.available(gen_num, accumulated) # Outdated Pokémon still add weight
+        monotypes = (bitset & self.monotypes[i]).bit_count()
+        return monotypes + (bitset.bit_count() - monotypes) * 0.5
+
+
+    def names(self, bitset: int) -> list[str]:
+        """Returns the names of the Pokémon in a `bitset`, in the order of the dataset."""
+
+        names = []
+        while bitset:
+            low = bitset & -bitset
+            names.append(self.rows[low.bit_length() - 1])
+            bitset ^= low
+        return names
+
+
 def get_balance(data: list[float]):
     """Returns the "balance" of the `data` as a number from 0 to 100 (a percentage). This is an
     adaptation of the Gini coefficient used in economics."""
@@ -100,4 +319,72 @@ def get_diversity(data: list[float]):
     equity = shannon_index / max_index
     percentage = equity * 100
 
-    return percentage
\ No newline at end of file
+    return percentage
+
+
+def get_weight_table(matrix: CountMatrix, types: list[str], first: int, last: int, partial = False, accumulated = False) -> tuple[list[tuple[str, ...]], list[list[float | None]]]:
+    """Returns every typing of the `types` (see `get_typings`) along with a table of their weights,
+    with a row for every generation from `first` to `last` and a column for every typing. Typings
+    that don't exist yet at a generation (such as fairy before gen 6) are masked as `None`.
+
+    Weights are the same ones generation resources use: type weights if `partial` is `True`, and
+    counts otherwise."""
+
+    typings = get_typings(types, max(matrix.gens, 6), partial) # Every typing exists by gen 6
+    table = []
+    for gen_num in range(first, last + 1):
+        existing = set(get_typings(types, gen_num, partial))
+        row = []
+        for typing in typings:
+            if typing not in existing:
+                row.append(None)
+            elif partial:
+                row.append(matrix.weight(gen_num, typing[0], accumulated = accumulated))
+            else:
+                row.append(matrix.count(gen_num, *typing, accumulated = accumulated))
+        table.append(row)
+
+    return typings, table
+
+
+def get_balances(table: list[list[float | None]]) -> list[float | None]:
+    """Returns the `get_balance` of every row of a `table`, leaving out masked (`None`) entries, or
+    `None` for rows where it isn't defined (no weight at all)."""
+
+    balances = []
+    coefficients = {} # Row length -> the (2i - n - 1) factor of every sorted item
+    for row in table:
+        data = [value for value in row if value is not None]
+        n = len(data)
+        total = sum(data)
+        if not total:
+            balances.append(None)
+            continue
+
+        factors = coefficients.get(n)
+        if factors is None:
+            factors = coefficients[n] = range(1 - n, n, 2)
+        gini_index = sum(map(mul, factors, sorted(data))) / (n * total)
+        balances.append((1 - gini_index) * 100)
+
+    return balances
+
+
+def get_diversities(table: list[list[float | None]]) -> list[float | None]:
+    """Returns the `get_diversity` of every row of a `table`, leaving out masked (`None`) entries, or
+    `None` for rows where it isn't defined (less than two typings)."""
+
+    diversities = []
+    for row in table:
+        data = [value for value in row if value is not None]
+        S = len(data)
+        if S < 2:
+            diversities.append(None)
+            continue
+
+        N = sum(data)
+        relative_weights = [weight / N for weight in data if weight > 0]
+        shannon_index = -sum(map(mul, relative_weights, map(log10, relative_weights)))
+        diversities.append(shannon_index / log10(S) * 100)
+
+    return diversities
@@ -0,0 +1,67 @@
+"""Compact, columnar form of the main resource, which is what calculations work with."""
+
+
+from array import array
+from src.utils.manage_json import read_source
+
+
+class Dataset:
+    """The Pokémon of a `source` (the main resource, as a list of dicts) stored by column instead of
+    by row. Type names are interned as ids, and so are typings (tuples of type ids, in the order of
+    the source), so the typing of every Pokémon at every generation is a single small integer.
+
+    Row `i` of every column belongs to the `i`-th Pokémon of the source."""
+
+    __slots__ = ('gens', 'names', 'gen', 'evolves_at', 'region_only', 'national_dex_num',
+                 'type_names', 'type_ids', 'typings', 'typing_names', 'typing_ids', 'typing_codes')
+
+    def __init__(self, source: list[dict], gens: int | None = None):
+        self.gens = gens or (len(source[0]['types']) if source else 0)
+        self.names = [pokemon['name'] for pokemon in source]
+        self.gen = array('B', [pokemon['gen'] for pokemon in source])
+        self.evolves_at = array('H', [pokemon['evolves_at'] for pokemon in source])
+        self.region_only = array('B', [pokemon['region_only'] for pokemon in source])
+        self.national_dex_num = array('H', [pokemon['national_dex_num'] for pokemon in source])
+
+        self.type_names = [] # Type id -> name
+        self.type_ids = {} # Name -> type id
+        self.typings = [] # Typing id -> tuple of type ids
+        self.typing_names = [] # Typing id -> tuple of type names
+        self.typing_ids = {} # Tuple of type names -> typing id
+        self.typing_codes = [array('H') for _ in range(self.gens)] # Per gen: row -> typing id
+
+        for pokemon in source:
+            types = pokemon['types']
+            for gen_num in range(1, self.gens + 1):
+                self.typing_codes[gen_num - 1].append(self._intern(tuple(types[f'gen_{gen_num}'])))
+
+
+    def _intern(self, typing: tuple[str, ...]) -> int:
+        """Returns the id of a `typing` (given by type names), allocating it if it's new."""
+
+        typing_id = self.typing_ids.get(typing)
+        if typing_id is None:
+            type_ids = []
+            for type in typing:
+                if type not in self.type_ids:
+                    self.type_ids[type] = len(self.type_names)
+                    self.type_names.append(type)
+                type_ids.append(self.type_ids[type])
+            typing_id = self.typing_ids[typing] = len(self.typings)
+            self.typings.append(tuple(type_ids))
+            self.typing_names.append(typing)
+        return typing_id
+
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+    def typing(self, row: int, gen_num: int) -> tuple[str, ...]:
+        """Returns the type names of the Pokémon at `row` in the generation of the given `gen_num`."""
+        return self.typing_names[self.typing_codes[gen_num - 1][row]]
+
+
+def load_dataset() -> Dataset:
+    """Reads the main resource and converts it into a `Dataset`."""
+    return Dataset(read_source())
@@ -1,54 +1,203 @@
-import requests, os, logging, roman
-from time import sleep
+import requests, os, logging, roman, threading
+from time import sleep, monotonic
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from src.utils.constants import BASE_URL, TEMPORARY, REGION_ONLY, SPECIALS, NO_DEFAULT_FORM
+from src.utils.http_cache import HttpCache
+from src.utils.metrics import metrics
+from src.utils.paths import CACHE
 
 load_dotenv()
 env = os.getenv('ENV', 'development')
+base_url = os.getenv('POKEAPI_URL', BASE_URL).rstrip('/') + '/' # Another server with the same API, such as the local stand-in in benchmarks
+workers = int(os.getenv('FETCH_WORKERS', 4)) # Threads used by `call_many`
+rate = float(os.getenv('FETCH_RATE', 5)) # Requests per second, shared by all threads
+read_timeout = float(os.getenv('FETCH_TIMEOUT', 30)) # Seconds to wait for a response before retrying
+use_cache = os.getenv('HTTP_CACHE', '1') == '1'
+cache_ttl = float(os.getenv('HTTP_CACHE_TTL_DAYS', 30)) * 24 * 60 * 60
+cache_max_size = int(os.getenv('HTTP_CACHE_MAX_MB', 512)) * 1024 * 1024
 logger = logging.getLogger(__name__)
 
-def call(endpoint: str) -> dict:
+MAX_ATTEMPTS = 10
+BACKOFF_BASE = 0.5 # Seconds to wait after the first failed attempt, doubled after each one
+BACKOFF_MAX = 60
+CONNECT_TIMEOUT = 10
+
+
+class RateLimiter:
+    """Token bucket shared by every thread that calls PokéAPI. Tokens are refilled at `rate` per
+    second up to `burst`, and each request takes one."""
+
+    def __init__(self, rate: float, burst = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+
+    def acquire(self):
+        """Blocks until a token is available, then takes it."""
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+    def pause(self, seconds: float):
+        """Empties the bucket so that no thread sends requests for the next `seconds`."""
+        with self.lock:
+            self.tokens = min(self.tokens, -seconds * self.rate) # Not added up, when many threads pause at once
+
+
+limiter = RateLimiter(rate)
+
+session = requests.Session() # Pooled, keep-alive connections shared by all threads
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 10)))
+session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 10)))
+
+cache = HttpCache(CACHE, cache_ttl, cache_max_size) if use_cache else None
+
+crawled_species = {} # Name -> number of every member of every chain crawled by this process, entries or not
+
+
+def get_retry_after(response: requests.Response) -> float | None:
+    """Reads the `Retry-After` header of a response, which can be given in seconds or as a date."""
+
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+        return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def call(endpoint: str, revalidate = False) -> dict:
     """
     Manages requests to PokéAPI, including checking response status, spacing requests in time and
     extracting JSON.\n
     It also works with partial URLs. For example: passing the string `"pokemon"`
     calls the `https://pokeapi.co/api/v2/pokemon` endpoint.
+
+    Requests are spaced by a rate limiter shared between threads, so this function can be called
+    concurrently (see `call_many`). Failed attempts are retried with exponential backoff, honouring
+    the `Retry-After` header of 429 responses.
+
+    Responses are kept in an on-disk cache (see `HttpCache`). Fresh entries are returned without any
+    request, and stale ones are revalidated with a conditional request. Set `revalidate` to `True`
+    to always ask the server, which is useful for listings that change when new Pokémon are added.
+
+    Durations are recorded by endpoint (such as `pokemon-species`) and outcome (`cached`,
+    `revalidated`, `downloaded` or `failed`), along with the number of retries.
     """
 
-    url = endpoint if endpoint.startswith(BASE_URL) else BASE_URL + endpoint
+    url = endpoint if endpoint.startswith(base_url) else base_url + endpoint
+    endpoint_class = url.removeprefix(base_url).split('?')[0].split('/')[0]
+
+    with metrics.timer('pokeback_fetch_duration_seconds', endpoint=endpoint_class, outcome='failed') as labels:
+        data, labels['outcome'] = fetch(url, endpoint_class, revalidate)
+    return data
+
+
+def fetch(url: str, endpoint_class: str, revalidate: bool) -> tuple[dict, str]:
+    """Does the actual work of `call`, returning the data along with how it was obtained."""
+
+    entry = cache.get(url) if cache else None
+    if entry and not revalidate and cache.is_fresh(entry):
+        data = cache.load(entry)
+        if data is not None:
+            return data, 'cached'
 
     attempts = 0
-    while attempts < 10:
+    while attempts < MAX_ATTEMPTS:
+        if attempts:
+            metrics.increment('pokeback_fetch_retries_total', endpoint=endpoint_class)
         attempts += 1
+        delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
 
         try:
-            sleep(0.2) # Even when requests are successful, they must be spaced to avoid 429.
-            response = requests.get(url)
+            limiter.acquire() # Even when requests are successful, they must be spaced to avoid 429.
+            response = session.get(url, headers=cache.validators(entry) if entry else None, timeout=(CONNECT_TIMEOUT, read_timeout)) # A hung connection is retried, instead of blocking its thread forever
+
+            if response.status_code == 304 and entry:
+                data = cache.load(entry)
+                if data is not None:
+                    cache.refresh(entry)
+                    return data, 'revalidated'
+                entry = None # The cached body is gone, so the next attempt won't be conditional
+                continue
+
+            if response.status_code == 429:
+                delay = get_retry_after(response) or delay
+                limiter.pause(delay) # Every thread must slow down, not only this one
+                logger.error(f'Rate limited calling {url}. Attempt {attempts}, retrying in {delay} s.')
+                sleep(delay)
+                continue
+
             response.raise_for_status()
             if env == 'development':
                 logger.info(f'Successful call to {url}')
-            return response.json()
+            data = response.json()
+            if cache:
+                cache.put(url, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            return data, 'downloaded'
+
+        except requests.exceptions.HTTPError as error:
+            if error.response.status_code < 500:
+                logger.critical(f'Request to {url} failed: {error}')
+                raise RuntimeError(f'ERROR: Request to {url} failed: {error}') # Client errors won't be fixed by retrying
+
+            logger.error(f'Failed call to {url}. Attempt {attempts}: {error}')
+            sleep(delay)
 
         except requests.exceptions.RequestException as error:
             logger.error(f'Failed call to {url}. Attempt {attempts}: {error}')
+            sleep(delay)
+
+    logger.critical(f'Request to {url} failed after {MAX_ATTEMPTS} attempts.')
+    raise RuntimeError(f'ERROR: Request to {url} failed after {MAX_ATTEMPTS} attempts.')
 
-    logger.critical(f'Request to {url} failed after 10 attempts.')
-    raise RuntimeError(f'ERROR: Request to {url} failed after 10 attempts.')
 
+def call_many(endpoints: list[str], max_workers: int | None = None, revalidate = False) -> list[dict]:
+    """Calls every endpoint in `endpoints` using a pool of threads, and returns the results in the
+    same order. The number of threads defaults to the `FETCH_WORKERS` environment variable, and
+    `revalidate` works as in `call`."""
 
-def get_chain_members(chain: dict) -> list[str]:
-    """Returns the names of all Pokémon in the `evolution-chain`."""
+    max_workers = max_workers or workers
+    if max_workers <= 1 or len(endpoints) <= 1:
+        return [call(endpoint, revalidate) for endpoint in endpoints]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(partial(call, revalidate = revalidate), endpoints))
+
+
+def get_chain_species(chain: dict) -> dict[str, str]:
+    """Returns the `pokemon-species` URLs of all Pokémon in the `evolution-chain`, by name."""
 
     chain_link = chain['chain']
-    members = []
+    species = {}
 
     def parse(chain_link: dict): # Recursive function, complex behavior
-        members.append(chain_link['species']['name'])
+        species[chain_link['species']['name']] = chain_link['species']['url']
         for evolution in chain_link['evolves_to']:
             parse(evolution)
 
     parse(chain_link)
-    return members
+    return species
 
 
 def get_last_evols(chain: dict) -> list[str]:
@@ -123,7 +272,92 @@ def get_types(pokemon: dict, max_gen: int) -> dict:
     return types
 
 
-def get_data(limit = 10) -> list[dict]:
+def get_species_id(url: str) -> int:
+    """Extracts the ID from a `pokemon-species` URL, which matches the National Pokédex number."""
+    return int(url.rstrip('/').split('/')[-1])
+
+
+def make_entry(name: str, species: dict, pokemon: dict, gens: int) -> dict:
+    """Builds the entry of the main resource for a last evolution, given its `pokemon-species` and
+    default `pokemon` data (see `get_data`)."""
+
+    gen = species['generation']['name']
+    gen_num_roman = gen.split('-')[-1]
+    gen_num = roman.fromRoman(gen_num_roman)
+
+    national_dex_num = find_national_dex_num(species)
+    types = get_types(pokemon, gens)
+
+    return {'name': name,
+            'gen': gen_num,
+            'national_dex_num': national_dex_num,
+            'types': types,
+            'region_only': name in REGION_ONLY,
+            'evolves_at': TEMPORARY.get(name, 999)}
+
+
+def find_chains(data: list[dict], max_workers: int | None = None, revalidate = False) -> tuple[list[dict], dict[str, dict]]:
+    """Fetches every species in `data` (a list of `name`/`url` pairs, as listed by the
+    `pokemon-species` endpoint) to find their evolution chains, which are then fetched once each.
+    Returns the chains, in the order their first member appears, and the fetched species by name.
+
+    This is meant for a few species. For the whole Pokédex, `list_chains` is cheaper. With
+    `revalidate`, cached responses are revalidated (see `call`), as they're expected to change."""
+
+    species_list = call_many([pokemon['url'] for pokemon in data], max_workers, revalidate)
+    species_cache = {pokemon['name']: species for pokemon, species in zip(data, species_list)}
+
+    chain_urls = list(dict.fromkeys(species['evolution_chain']['url'] for species in species_list)) # Every chain only once, in the order its first member appears
+    return call_many(chain_urls, max_workers, revalidate), species_cache
+
+
+def list_chains(max_workers: int | None = None) -> list[dict]:
+    """Fetches every evolution chain, as listed up front by the `evolution-chain` endpoint. Returns
+    them in the order of their first member in the National Pokédex, like `find_chains` would for
+    the whole Pokédex, but without fetching a single species."""
+
+    listing = call('evolution-chain?limit=9999', revalidate = True).get('results')
+    chains = call_many([chain['url'] for chain in listing], max_workers)
+    return sorted(chains, key=lambda chain: min(map(get_species_id, get_chain_species(chain).values())))
+
+
+def crawl(chains: list[dict], gens: int, max_workers: int | None = None, species_cache: dict[str, dict] | None = None, revalidate = False) -> list[tuple[list[str], list[dict]]]:
+    """Builds the entries of the last evolutions of every evolution chain in `chains` (see
+    `find_chains` and `list_chains`). For every chain, in the same order, it returns the names of
+    all its members along with the entries of its last evolutions (see `get_data`).
+
+    The species of every last evolution that isn't in `species_cache` (by name) and their default
+    forms are then fetched, each only once, with up to `max_workers` concurrent requests (see
+    `call_many`), and revalidated if `revalidate` is `True` (see `call`). The result doesn't depend
+    on that number."""
+
+    species_cache = dict(species_cache or {})
+    species_urls = {}
+
+    chain_evolutions = []
+    for chain_data in chains:
+        chain_species = get_chain_species(chain_data)
+        species_urls.update(chain_species)
+        crawled_species.update((name, get_species_id(url)) for name, url in chain_species.items())
+        chain_members = list(chain_species)
+        last_evols = get_last_evols(chain_data)
+        specials_in_chain = set(chain_members).intersection(SPECIALS)
+        last_evols.extend(specials_in_chain) # Processing specials when they're part of chain
+        last_evols = [evolution for evolution in last_evols if evolution not in NO_DEFAULT_FORM] # Skipping Pokémon without a default form
+        chain_evolutions.append((chain_members, last_evols))
+
+    evolutions = list(dict.fromkeys(evolution for _, last_evols in chain_evolutions for evolution in last_evols)) # Without duplicates, keeping the order
+    missing = [evolution for evolution in evolutions if evolution not in species_cache]
+    species_cache.update(zip(missing, call_many([species_urls[name] for name in missing], max_workers, revalidate)))
+
+    default_forms = [find_default_form(species_cache[evolution]) for evolution in evolutions]
+    pokemon_list = call_many([default_form['url'] for default_form in default_forms], max_workers, revalidate)
+
+    entries = {evolution: make_entry(evolution, species_cache[evolution], pokemon_data, gens) for evolution, pokemon_data in zip(evolutions, pokemon_list)}
+    return [(chain_members, [entries[evolution] for evolution in last_evols]) for chain_members, last_evols in chain_evolutions]
+
+
+def get_data(limit = 10, max_workers: int | None = None) -> list[dict]:
     """
     Accesses PokéAPI, returning a list of every Pokémon that doesn't evolve (i.e., every *"last
     evolution"*) in the form of a dict with the next keys:
@@ -136,57 +370,82 @@ def get_data(limit = 10) -> list[dict]:
     - `types`: The types it had on every generation.
 
     To prevent excessive requests during development, a `limit` is set to 10. For usage, call the
-    function with a high enough number, like 9999.
+    function with a high enough number, like 9999, so every evolution chain is listed and fetched
+    directly (see `list_chains`). Requests are made concurrently by `crawl`.
     """
 
-    data = call(f'pokemon-species?limit={limit}').get('results')
-    gens = call('generation').get('count', 9) # Obtain current number of generations and last gen number (same)
-
-    results = []
-
-    names_cache = []
-    species_cache = {}
-
-    for pokemon in data:
+    listing = call(f'pokemon-species?limit={limit}', revalidate = True)
+    data = listing.get('results')
+    gens = call('generation', revalidate = True).get('count', 9) # Obtain current number of generations and last gen number (same)
 
-        name = pokemon['name']
-        if name not in names_cache:
-            species_data = call(pokemon['url'])
-            species_cache[name] = species_data # Caching species data for later
-            chain_data = call(species_data['evolution_chain']['url'])
-
-            chain_members = get_chain_members(chain_data)
-            names_cache.extend(chain_members) # Caching all evolutions
-
-            last_evols = get_last_evols(chain_data)
-            specials_in_chain = set(chain_members).intersection(SPECIALS)
-            last_evols.extend(specials_in_chain) # Processing specials when they're part of chain
-
-            for evolution in last_evols:
-                if evolution in NO_DEFAULT_FORM:
-                    continue # Skipping Pokémon without a default form
-
-                if evolution in species_cache: # Caching in line 145 avoids repetitive calls for single-member evolution chains
-                    evolution_species_data = species_cache[evolution]
-                else:
-                    evolution_species_data = call('pokemon-species/' + evolution)
-
-                default_form = find_default_form(evolution_species_data)
-                pokemon_data = call(default_form['url'])
+    if len(data) < listing.get('count', 0): # Only part of the Pokédex, so chains are found through its species
+        chains, species_cache = find_chains(data, max_workers)
+    else:
+        chains, species_cache = list_chains(max_workers), None
 
-                gen = evolution_species_data['generation']['name']
-                gen_num_roman = gen.split('-')[-1]
-                gen_num = roman.fromRoman(gen_num_roman)
+    return [entry for _, entries in crawl(chains, gens, max_workers, species_cache) for entry in entries]
 
-                national_dex_num = find_national_dex_num(evolution_species_data)
-                types = get_types(pokemon_data, gens)
 
-                full_json = {'name': evolution,
-                             'gen': gen_num,
-                             'national_dex_num': national_dex_num,
-                             'types': types,
-                             'region_only': evolution in REGION_ONLY,
-                             'evolves_at': TEMPORARY.get(evolution, 999)}
-                results.append(full_json)
+def refresh_data(source: list[dict], max_workers: int | None = None) -> tuple[list[dict], bool]:
+    """
+    Brings a `source` list, as returned by `get_data`, up to date without crawling the whole
+    PokéAPI again. Returns the refreshed list and whether anything changed.
+
+    Only species that are new (numbered after every Pokémon in the `source`) or touched (listed
+    with a different number than the one stored) have their evolution chains fetched. Members of
+    chains crawled before aren't new, even if they have no entry (pre-evolutions, or Pokémon without
+    a default form). Entries of those chains are replaced by the fetched ones, keeping their
+    position, while entries of new chains are appended at the end. The `types` of every entry are extended when new generations
+    exist, and `evolves_at` and `region_only` are recomputed from the constants module.
+    """
 
-    return results
\ No newline at end of file
+    data = call('pokemon-species?limit=9999', revalidate = True).get('results')
+    gens = call('generation', revalidate = True).get('count', 9)
+
+    known_numbers = {pokemon['name']: pokemon['national_dex_num'] for pokemon in source}
+    last_known = max(known_numbers.values(), default=0)
+    known_numbers = crawled_species | known_numbers # Every member of a crawled chain, not only entries
+    to_fetch = []
+    for species in data:
+        number = get_species_id(species['url'])
+        if species['name'] in known_numbers:
+            if known_numbers[species['name']] != number:
+                to_fetch.append(species) # Touched
+        elif number > last_known:
+            to_fetch.append(species) # New
+
+    results = list(source) # Entries are copied only if they change, so the rest stay the same objects (see `get_affected_tasks`)
+    changed = False
+
+    if to_fetch:
+        logger.info(f'Fetching evolution chains for {len(to_fetch)} new or touched species...')
+        chains, species_cache = find_chains(to_fetch, max_workers, revalidate = True) # Cached chains may lack the new species
+        crawled = crawl(chains, gens, max_workers, species_cache, revalidate = True)
+        chain_of = {name: index for index, (chain_members, _) in enumerate(crawled) for name in chain_members}
+
+        merged = []
+        placed = set()
+        for pokemon in results: # Fetched chains replace their old entries at the position of the first one
+            index = chain_of.get(pokemon['name'])
+            if index is None:
+                merged.append(pokemon)
+            elif index not in placed:
+                merged.extend(crawled[index][1])
+                placed.add(index)
+        for index, (_, entries) in enumerate(crawled): # New chains go at the end
+            if index not in placed:
+                merged.extend(entries)
+        changed = merged != results # Chains may give the same entries, if none of their new species is one
+        results = merged
+
+    for index, pokemon in enumerate(results):
+        region_only = pokemon['name'] in REGION_ONLY
+        evolves_at = TEMPORARY.get(pokemon['name'], 999)
+        if len(pokemon['types']) < gens or (pokemon['region_only'], pokemon['evolves_at']) != (region_only, evolves_at):
+            types = dict(pokemon['types'])
+            for gen_num in range(len(types) + 1, gens + 1): # New generations keep the latest types
+                types[f'gen_{gen_num}'] = types[f'gen_{gen_num - 1}']
+            results[index] = dict(pokemon, types=types, region_only=region_only, evolves_at=evolves_at)
+            changed = True
+
+    return results, changed
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""Runs updates as background jobs, so that requests don't wait for them and concurrent triggers
+don't run more than one update at a time. Jobs are recorded on disk, so that every process serving
+the app can report them, and processes that don't run updates can request them."""
+
+
+import logging, threading, uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter, sleep
+from src.resources.updater import update
+from src.utils.manage_json import read_json, write_json
+from src.utils.paths import JOBS
+
+logger = logging.getLogger(__name__)
+
+HISTORY = 20 # Finished jobs kept for status queries
+
+
+class UpdateJob:
+    """A single run of `update`, with its progress through every stage and its outcome."""
+
+    def __init__(self, trigger: str, kwargs: dict, folder: Path | None = None):
+        self.id = uuid.uuid4().hex
+        self.folder = folder # Where the job is recorded, if anywhere
+        self.trigger = trigger
+        self.kwargs = kwargs
+        self.status = 'queued'
+        self.error = None
+        self.created_at = datetime.now(timezone.utc)
+        self.stages = []
+        self.triggers = 1 # How many triggers share this run
+        self.done = threading.Event()
+        self.started = None
+        self.seconds = None
+        self.build = None # What the build rebuilt and reused, see `build`
+
+
+    def stage(self, name: str | None):
+        """Closes the current stage, if any, and starts a new one with the given `name`."""
+
+        now = perf_counter()
+        if self.stages:
+            current = self.stages[-1]
+            current['seconds'] = now - current['start'] # Set before 'start' is removed, since `to_dict` may be reading it
+            del current['start']
+        if name:
+            self.stages.append({'name': name, 'start': now})
+            self.save()
+
+
+    def set_build(self, report: dict):
+        self.build = report
+        self.save()
+
+
+    def save(self):
+        """Records the job as it is now, for other processes to read it (see `UpdateQueue.get`)."""
+
+        if self.folder is None:
+            return
+        try:
+            write_json(self.to_dict(), self.folder / f'{self.id}.json')
+        except OSError as error:
+            logger.warning(f'Update job {self.id} could not be recorded: {error}')
+
+
+    def run(self):
+        self.status = 'running'
+        self.started = perf_counter()
+        try:
+            update(progress=self.stage, report=self.set_build, raise_errors=True, **self.kwargs)
+            self.status = 'succeeded'
+        except Exception as error:
+            logger.exception(f'Update job {self.id} failed.')
+            self.status = 'failed'
+            self.error = str(error)
+        finally:
+            self.stage(None)
+            self.seconds = perf_counter() - self.started
+            self.save()
+            self.done.set()
+
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Blocks until the job is finished, returning whether it did before the `timeout`."""
+        return self.done.wait(timeout)
+
+
+    def to_dict(self) -> dict:
+        stages = [{'name': stage['name'], 'seconds': stage['seconds'] if 'seconds' in stage else perf_counter() - stage['start']} for stage in self.stages]
+        return {'id': self.id,
+                'trigger': self.trigger,
+                'triggers': self.triggers,
+                'status': self.status,
+                'stage': self.stages[-1]['name'] if self.status == 'running' and self.stages else None,
+                'stages': stages,
+                'created_at': self.created_at.isoformat(),
+                'seconds': self.seconds,
+                'build': self.build,
+                'error': self.error}
+
+
+class UpdateQueue:
+    """Starts update jobs with single-flight coalescing: while a job is queued or running, every new
+    trigger gets that same job instead of starting another one.
+
+    Jobs are recorded in `folder`, along with the requests of processes that don't run updates
+    themselves (see `request`), which the one that does takes from there (see `watch`)."""
+
+    def __init__(self, folder = JOBS):
+        self.lock = threading.Lock()
+        self.current = None
+        self.jobs = OrderedDict() # Job ID -> job, oldest first
+        self.folder = folder
+        self.requests = folder / 'requests'
+        self.watcher = None
+
+
+    def submit(self, trigger = 'manual', **kwargs) -> UpdateJob:
+        """Returns the job that is currently running, or starts a new one passing `kwargs` to `update`."""
+
+        with self.lock:
+            if self.current and not self.current.done.is_set():
+                self.current.triggers += 1
+                self.current.save()
+                logger.info(f'Update triggered ({trigger}) while job {self.current.id} is running. Joining it.')
+                return self.current
+
+            self.folder.mkdir(parents=True, exist_ok=True)
+            job = UpdateJob(trigger, kwargs, self.folder)
+            self.current = job
+            self.jobs[job.id] = job
+            while len(self.jobs) > HISTORY:
+                self.jobs.popitem(last=False)
+            job.save()
+            self.prune()
+
+        logger.info(f'Update job {job.id} started ({trigger}).')
+        threading.Thread(target=job.run, name=f'update-{job.id}', daemon=True).start()
+        return job
+
+
+    def request(self, trigger = 'manual') -> dict:
+        """Asks the process that runs updates for one, returning the job as it is known so far. It can
+        then be followed by its ID (see `get`), which points to the job it joins once it's taken."""
+
+        job = UpdateJob(trigger, {})
+        self.requests.mkdir(parents=True, exist_ok=True)
+        write_json(job.to_dict(), self.requests / f'{job.id}.json')
+        return job.to_dict()
+
+
+    def take_requests(self):
+        """Submits the update requested by other processes, if any (see `request`). Every request is
+        recorded as a pointer to the job that answers it."""
+
+        for path in sorted(self.requests.glob('*.json')):
+            try:
+                trigger = read_json(path)['trigger']
+                path.unlink()
+            except (OSError, ValueError, KeyError) as error:
+                logger.warning(f'Update request {path.stem} could not be read: {error}')
+                continue
+            job = self.submit(trigger)
+            write_json({'id': path.stem, 'job': job.id}, self.folder / f'{path.stem}.json')
+
+
+    def watch(self, interval: float):
+        """Takes requests from other processes every `interval` seconds, from a background thread
+        that lives as long as this process. Only the process that runs updates does this."""
+
+        def run():
+            while True:
+                try:
+                    self.take_requests()
+                except Exception:
+                    logger.exception('Update requests could not be taken.')
+                sleep(interval)
+
+        with self.lock:
+            if self.watcher is None:
+                self.watcher = threading.Thread(target=run, name='update-requests', daemon=True)
+                self.watcher.start()
+
+
+    def prune(self):
+        """Deletes the records of the oldest jobs (and pointers to them), keeping `HISTORY` of them."""
+
+        records = sorted(self.folder.glob('*.json'), key=lambda path: path.stat().st_mtime)
+        for path in records[:-HISTORY * 2]: # Pointers are records too
+            path.unlink(missing_ok=True)
+
+
+    def get(self, job_id: str) -> dict | None:
+        """Returns the job with the given ID, as run by this process or recorded by another one, or the
+        request of that ID if it wasn't taken yet."""
+
+        job = self.jobs.get(job_id)
+        if job:
+            return job.to_dict()
+        if not job_id.isalnum():
+            return None
+
+        for path in (self.folder / f'{job_id}.json', self.requests / f'{job_id}.json'):
+            try:
+                record = read_json(path)
+            except (OSError, ValueError):
+                continue
+            if 'job' in record: # A request, answered by another job
+                return self.get(record['job'])
+            return record
+        return None
+
+
+updates = UpdateQueue()
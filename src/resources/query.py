@@ -0,0 +1,205 @@
+"""Statistics over arbitrary generation ranges and typings, computed on demand from the main
+resource and memoized."""
+
+
+import os, logging
+from functools import lru_cache
+from src.utils.constants import TYPES as local_types
+from src.resources.dataset import Dataset, load_dataset
+from src.resources.calculations import CountMatrix, TypeIndex, get_balance, get_balances, get_diversity, get_diversities, get_typings, get_weight_table
+from src.utils.snapshots import read_snapshot_source
+
+logger = logging.getLogger(__name__)
+cache_size = int(os.getenv('QUERY_CACHE_SIZE', 256)) # Queries whose results are kept in memory
+
+
+def get_statistic(function, weights: list[float]) -> float | None:
+    """Applies `get_balance` or `get_diversity` to the `weights`, returning `None` when the statistic
+    isn't defined (no weight at all, or less than two typings)."""
+
+    try:
+        return function(weights)
+    except (ZeroDivisionError, ValueError):
+        return None
+
+
+def parse_gens(text: str | None, gens: int) -> tuple[int, int]:
+    """Parses a generation range such as `"3-5"`, or a single generation such as `"4"`. Every
+    generation is included if `text` is empty."""
+
+    if not text:
+        return 1, gens
+
+    first, _, last = text.partition('-')
+    try:
+        first, last = int(first), int(last or first)
+    except ValueError:
+        raise ValueError(f'Invalid generation range: "{text}".')
+
+    if not 1 <= first <= last <= gens:
+        raise ValueError(f'Generation range "{text}" is out of bounds. Expected numbers from 1 to {gens}.')
+    return first, last
+
+
+def parse_typings(text: str | None, types: list[str], partial: bool) -> tuple[tuple[str, ...], ...] | None:
+    """Parses a comma-separated list of typings, where dual typings are joined with a slash, such as
+    `"fire/flying,water"`. Returns `None` if `text` is empty, meaning every typing."""
+
+    if not text:
+        return None
+
+    typings = []
+    for item in text.split(','):
+        typing = tuple(sorted(item.strip().lower().split('/')))
+        if not 1 <= len(typing) <= (1 if partial else 2) or len(set(typing)) != len(typing):
+            raise ValueError(f'Invalid typing "{item}" for {"partial" if partial else "strict"} mode.')
+        unknown = [type for type in typing if type not in types]
+        if unknown:
+            raise ValueError(f'Unknown type "{unknown[0]}".')
+        typings.append(typing)
+
+    return tuple(dict.fromkeys(typings)) # Without duplicates, keeping the order
+
+
+class QueryEngine:
+    """Answers queries about counts, weights, diversity and balance of any set of typings over a
+    range of generations, using a `CountMatrix` of the main resource. Results are memoized in a
+    bounded LRU cache, which is emptied whenever new data is loaded. The Pokémon behind each count
+    are listed from a `TypeIndex` of the same resource."""
+
+    def __init__(self, size = cache_size):
+        self.size = size
+        self.matrix = None
+        self.index = None
+        self.types = None
+        self.cached_query = None
+
+
+    def load(self, matrix: CountMatrix, index: TypeIndex, types: list[str]):
+        """Replaces the data used to answer queries, and empties the cache."""
+
+        self.matrix = matrix
+        self.index = index
+        self.types = types
+        self.cached_query = lru_cache(maxsize=self.size)(self.compute)
+
+
+    def reload(self):
+        """Reads the main resource from disk and answers queries from it from now on (for example,
+        after another process updated it, or after a rollback). It's read from the published
+        snapshot, so answers agree with its resources, or from the source file if the snapshot
+        didn't store it."""
+
+        try:
+            source = read_snapshot_source()
+        except (OSError, ValueError) as error:
+            logger.error(f'The main resource of the snapshot could not be read: {error}')
+            source = None
+        dataset = Dataset(source) if source is not None else load_dataset()
+        types = [type for type in local_types if type not in ('unknown', 'stellar')]
+        self.load(CountMatrix(dataset), TypeIndex(dataset), types)
+        logger.info('Query data loaded from the main resource.')
+
+
+    def ensure_loaded(self):
+        """Loads the main resource from disk if no data was given yet (for example, if the last update
+        failed)."""
+
+        if self.matrix is None:
+            self.reload()
+
+
+    def query(self, gens: str | None = None, typings: str | None = None, partial = True, accumulated = False) -> dict:
+        """Parses and answers a query. `gens` is a range such as `"3-5"` and `typings` a list such as
+        `"fire/flying,water"`, both as received by the `/query` endpoint. `partial` and `accumulated`
+        work as in `get_types_count`. Raises `ValueError` for invalid queries."""
+
+        self.ensure_loaded()
+        gen_range = parse_gens(gens, self.matrix.gens)
+        parsed_typings = parse_typings(typings, self.types, partial)
+        return self.cached_query(gen_range, parsed_typings, partial, accumulated)
+
+
+    def timeseries(self, gens: str | None = None, partial = True, accumulated = False) -> dict:
+        """Returns the weights of every typing at every generation in the `gens` range, along with the
+        balance and diversity of each generation, all computed in one batch. Typings that don't exist
+        yet at a generation have a `None` weight. Arguments work as in `query`. Raises `ValueError`
+        for invalid ranges."""
+
+        self.ensure_loaded()
+        first, last = parse_gens(gens, self.matrix.gens)
+        typings, table = get_weight_table(self.matrix, self.types, first, last, partial, accumulated)
+        return {'mode': 'partial' if partial else 'strict',
+                'accumulated': accumulated,
+                'generations': list(range(first, last + 1)),
+                'typings': [list(typing) for typing in typings],
+                'weights': table,
+                'diversity': get_diversities(table),
+                'balance': get_balances(table)}
+
+
+    def members(self, gen_num: int, typings: str | None = None, partial = True, accumulated = False) -> dict:
+        """Lists the Pokémon counted for every typing in `typings` (or every typing of the generation)
+        at the given `gen_num`. Arguments work as in `query`. Raises `ValueError` for invalid
+        queries."""
+
+        self.ensure_loaded()
+        parse_gens(str(gen_num), self.index.gens)
+        parsed_typings = parse_typings(typings, self.types, partial) or get_typings(self.types, gen_num, partial)
+
+        members = []
+        for typing in parsed_typings:
+            names = self.index.names(self.index.members(gen_num, *typing, partial = partial, accumulated = accumulated))
+            members.append({'types': list(typing), 'count': len(names), 'pokemon': names})
+
+        return {'generation': gen_num, 'mode': 'partial' if partial else 'strict', 'accumulated': accumulated, 'members': members}
+
+
+    def compute(self, gen_range: tuple[int, int], typings: tuple | None, partial: bool, accumulated: bool) -> dict:
+        """Computes the result of an already parsed query. Every generation in the range gets its own
+        counters and statistics. Non-accumulated queries also get them for the whole range, since
+        Pokémon from different generations can then be added up."""
+
+        result = {'mode': 'partial' if partial else 'strict', 'accumulated': accumulated, 'generations': []}
+        range_counters = {}
+
+        for gen_num in range(gen_range[0], gen_range[1] + 1):
+            gen_typings = typings or get_typings(self.types, gen_num, partial)
+            counters = []
+            for typing in gen_typings:
+                count = self.matrix.count(gen_num, *typing, partial = partial, accumulated = accumulated)
+                weight = self.matrix.weight(gen_num, typing[0], accumulated = accumulated) if partial else count
+                counters.append({'types': list(typing), 'count': count, 'weight': weight})
+
+                total = range_counters.setdefault(typing, {'types': list(typing), 'count': 0, 'weight': 0.0})
+                total['count'] += count
+                total['weight'] += weight
+
+            weights = [counter['weight'] for counter in counters]
+            result['generations'].append({'generation': gen_num,
+                                          'counters': counters,
+                                          'diversity': get_statistic(get_diversity, weights),
+                                          'balance': get_statistic(get_balance, weights)})
+
+        if not accumulated:
+            counters = list(range_counters.values())
+            weights = [counter['weight'] for counter in counters]
+            result['range'] = {'generations': list(gen_range),
+                               'counters': counters,
+                               'diversity': get_statistic(get_diversity, weights),
+                               'balance': get_statistic(get_balance, weights)}
+
+        return result
+
+
+    def stats(self) -> dict:
+        """Returns the hit/miss statistics of the cache."""
+
+        if self.cached_query is None:
+            return {'hits': 0, 'misses': 0, 'size': 0, 'max_size': self.size}
+
+        info = self.cached_query.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'max_size': info.maxsize}
+
+
+queries = QueryEngine()
@@ -0,0 +1,74 @@
+"""Keeps every generated resource available in memory, already encoded, so it can be served as it
+is."""
+
+
+import logging
+from src.utils.manage_pack import Pack
+from src.utils.snapshots import get_current_version, get_pack_path
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """An immutable set of resources, as published by an update. Resources are read from its
+    memory-mapped pack."""
+
+    __slots__ = ('version', 'pack')
+
+    def __init__(self, version: str):
+        self.version = version
+        self.pack = Pack(get_pack_path(version))
+
+
+class ResourceCache:
+    """Gives access to the resources of the published snapshot, such as `generations/gen_1_partial`
+    or `types/fire_accumulated`, along with a strong ETag for each one."""
+
+    def __init__(self):
+        self.snapshot = None
+
+
+    def reload(self) -> bool:
+        """Loads the published snapshot, if it isn't loaded already. The new snapshot replaces the
+        old one all at once, so requests never get a mix of both. If it can't be read, the old one
+        is kept. Returns whether a new snapshot was loaded."""
+
+        version = get_current_version()
+        if version is None:
+            logger.error('Resources could not be loaded: no snapshot has been published.')
+            return False
+        if self.snapshot and self.snapshot.version == version:
+            return False
+
+        try:
+            snapshot = Snapshot(version)
+        except (OSError, ValueError) as error:
+            logger.error(f'Resources could not be loaded: {error}')
+            return False
+
+        self.snapshot = snapshot
+        logger.info(f'{len(snapshot.pack)} resources loaded into memory from snapshot {version}.')
+        return True
+
+
+    def is_ready(self) -> bool:
+        """Checks if resources can be served."""
+        return self.snapshot is not None
+
+
+    def names(self) -> list[str]:
+        """Returns the names of every resource, in the order they were built."""
+
+        snapshot = self.snapshot
+        return snapshot.pack.names() if snapshot else []
+
+
+    def get(self, name: str, encodings = ('identity',)) -> tuple[bytes, str, str] | None:
+        """Returns the content of the resource with the given `name` in the first of the `encodings`
+        it's available in, along with that coding and its ETag (see `Pack.get`), or `None` if it
+        doesn't exist."""
+
+        snapshot = self.snapshot
+        return snapshot.pack.get(name, encodings) if snapshot else None
+
+resources = ResourceCache()
\ No newline at end of file
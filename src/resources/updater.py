@@ -1,119 +1,350 @@
 # Imports from built-in modules
-import logging
-from itertools import combinations
+import os, logging, hashlib, json
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import compress as select, count # `compress` is the one of packs
+from math import ceil
+from operator import is_not
+from pathlib import Path
+from time import perf_counter
 # Imports from installed modules
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 # Imports from own modules
 from src.utils.constants import TYPES as local_types
-from src.utils.paths import DATA, GENERATIONS, TYPES, SOURCEFILE
-from src.utils.manage_json import read_json, write_json, is_source_ok
-from src.resources.fetcher import call, get_data
-from src.resources.calculations import get_balance, get_diversity, get_total_type_weight, get_types_count
+from src.utils.paths import SOURCEFILE
+from src.utils.manage_json import read_source, write_json, encode_json, is_source_ok, get_source_checksum
+from src.utils.manage_pack import Pack, compress, write_pack
+from src.utils.snapshots import add_source, create_snapshot, get_current_version, get_pack_path, publish, read_snapshot_source
+from src.utils.metrics import metrics
+from src.resources.fetcher import call, get_data, refresh_data
+from src.resources.dataset import Dataset
+from src.resources.calculations import CountMatrix, TypeIndex, get_balance, get_diversity, get_typings
+from src.resources.resource_cache import resources
+from src.resources.query import queries
 
 logger = logging.getLogger(__name__)
+build_workers = int(os.getenv('BUILD_WORKERS', 1)) # Processes used to create resources
 
+RESOURCES_VERSION = 1 # Must be increased whenever the same inputs start producing different resources
 
-def update():
-    """Updates all resources. If `from_scratch` is `True`, it performs all the logic pertaining
-    PokéAPI, including many requests, and creates the main resource. Otherwise, it works locally
-    from the preexistent file."""
+built_sources = {} # Version of the last snapshot built by this process -> its main resource, so it isn't read back
 
-    try:
-        if not is_source_ok():
-            logger.error('Main resource not found or corrupted. Attemting to create it from scratch...')
-            source = get_data(9999)
-            write_json(source, SOURCEFILE)
-            logger.info('Main data successfully fetched and written to JSON format.')
+
+def create_gen_resource(matrix: CountMatrix, types: list[str], gen_num: int, partial: bool, accumulated: bool) -> dict:
+    """It creates a resource for the generation of the given `gen_num`, including a count of Pokémon of every type and statistic indexes for them.
+
+    All of this function's parameters are passed to the `count` and `weight` methods of the `CountMatrix` class from the `calculations` module. Refer to said module for more info."""
+
+    result = {'generation': gen_num, 'counters': []}
+    weights = []
+
+    for typing in get_typings(types, gen_num, partial):
+        count = matrix.count(gen_num, *typing, partial = partial, accumulated = accumulated)
+        counter = {'types': [typing] if partial else list(typing), 'count': count}
+        result['counters'].append(counter)
+
+        if partial:
+            weight = matrix.weight(gen_num, typing[0], accumulated = accumulated)
         else:
-            source = read_json(SOURCEFILE)
+            weight = count # For strict counts, weight = count
+        weights.append(weight)
 
-        gens = call('generation').get('count', 9)
+    result['diversity'] = get_diversity(weights)
+    result['balance'] = get_balance(weights)
 
-        types_data = call('type').get('results')
-        types = [result['name'] for result in types_data] if types_data else local_types
-        types.remove('unknown'); types.remove('stellar')
+    return result
 
-    except RuntimeError as error:
-        logger.critical(error)
-        return
 
+def create_type_resource(matrix: CountMatrix, type: str, accumulated: bool) -> dict:
+    """Creates resources for the given `type` at every generation. It makes use of the `count`
+    method of the `CountMatrix`, passing the `accumulated` parameter to it."""
 
-    def create_gen_resource(gen_num: int, partial: bool, accumulated: bool):
-        """It creates a resource for the generation of the given `gen_num`, including a count of Pokémon of every type and statistic indexes for them, writing it all to a JSON file.
+    result = {'type': type, 'counters': []}
 
-        All of this function's parameters are passed to functions `get_types_count` and `get_total_type_weight` from the `calculations` module. Refer to said module for more info."""
+    for gen_num in range(1, matrix.gens + 1):
+        count = matrix.count(gen_num, type, partial = True, accumulated = accumulated)
+        counter = {'generation': gen_num, 'count': count}
+        result['counters'].append(counter)
 
-        result = {'generation': gen_num, 'counters': []}
-        weights = []
+    return result
 
-        adjusted_types = types.copy()
-        if gen_num < 6:
-            adjusted_types.remove('fairy')
-        if gen_num < 2:
-            adjusted_types.remove('steel')
-            adjusted_types.remove('dark')
 
-        duals = list(combinations(adjusted_types, 2))
-        all_typings = duals + [(type, ) for type in adjusted_types] # Normalize typing format
-        typings = [(type, ) for type in adjusted_types] if partial else all_typings
-        for typing in typings:
-            count = get_types_count(source, gen_num, *typing, partial = partial, accumulated = accumulated)
-            counter = {'types': [typing] if partial else list(typing), 'count': count}
-            result['counters'].append(counter)
+def run_task(matrix: CountMatrix, types: list[str], task: tuple) -> tuple[dict[str, bytes], float]:
+    """Runs a build `task`, which is either `('generation', gen_num, partial, accumulated)` or
+    `('type', type, accumulated)`. Returns the variants of the minified resource (see `compress`)
+    and the seconds it took to create them."""
 
-            if partial:
-                weight = get_total_type_weight(source, gen_num, typing[0], accumulated = accumulated)
-            else:
-                weight = count # For strict counts, weight = count
-            weights.append(weight)
+    start = perf_counter()
+    if task[0] == 'generation':
+        result = create_gen_resource(matrix, types, *task[1:])
+    else:
+        result = create_type_resource(matrix, *task[1:])
+    return compress(encode_json(result, minified = True)), perf_counter() - start
 
-        result['diversity'] = get_diversity(weights)
-        result['balance'] = get_balance(weights)
 
-        mode = 'partial' if partial else 'strict'
-        suffix = '_accumulated' if accumulated else ''
-        write_json(result, GENERATIONS / f'gen_{gen_num}_{mode}{suffix}.json')
+def get_resource_name(task: tuple) -> str:
+    """Returns the name a build `task` is stored with, such as `generations/gen_1_partial` or
+    `types/fire_accumulated`."""
 
-        prefix = '' if accumulated else 'non-'
-        logger.info(f'Data for generation {gen_num} ({prefix}accumulated, {mode} mode) successfully writen to JSON file.')
+    suffix = '_accumulated' if task[-1] else ''
+    if task[0] == 'generation':
+        mode = 'partial' if task[2] else 'strict'
+        return f'generations/gen_{task[1]}_{mode}{suffix}'
+    return f'types/{task[1]}{suffix}'
 
 
-    def create_type_resource(type: str, accumulated: bool):
-        """Creates resources for the given `type` at every generation. It makes use of the
-        `get_types_count` function, passing the `accumulated` parameter to it."""
-        result = {'type': type, 'counters': []}
-        suffix = '_accumulated' if accumulated else ''
+def get_checksum(source_checksum: str, types: list[str], gens: int) -> str:
+    """Returns a hash of every input of `build`, given the checksum of the main resource (see
+    `get_source_checksum`), so resources are only created again if it changes."""
 
-        for gen_num in range(1, gens + 1):
-            count = get_types_count(source, gen_num, type, partial = True, accumulated = accumulated)
-            counter = {'generation': gen_num, 'count': count}
-            result['counters'].append(counter)
+    inputs = json.dumps([RESOURCES_VERSION, gens, types, source_checksum]).encode()
+    return hashlib.sha256(inputs).hexdigest()
 
-        write_json(result, TYPES / f'{type}{suffix}.json')
 
-        prefix = '' if accumulated else 'non-'
-        logger.info(f'Data for {type} type at every generation ({prefix}accumulated) successfully writen to JSON file.')
+def get_inputs_checksum(types: list[str], gens: int) -> str:
+    """Returns a hash of the inputs of `build` other than the main resource. Resources can only be
+    reused from a build with the same hash."""
 
+    inputs = json.dumps([RESOURCES_VERSION, gens, types]).encode()
+    return hashlib.sha256(inputs).hexdigest()
 
-    logger.info('Creating resources for each generation...')
-    for gen in range(1, gens + 1):
-        for mode in [(True, True), (True, False), (False, False), (False, True)]:
-            create_gen_resource(gen, mode[0], mode[1])
 
-    logger.info('Creating resources for every type...')
+def get_contributions(pokemon: dict, gens: int) -> dict[tuple, object]:
+    """Returns what a main resource entry adds to every resource it can affect, keyed by
+    `('generation', gen_num, accumulated)` (for both modes) and `('type', type, accumulated)`.
+    Resources whose key is missing or has the same value for two versions of an entry are the same
+    with either of them (see `get_types_count` and `get_total_type_weight`)."""
+
+    contributions = {}
+    gen = pokemon['gen']
+    last_gen = gen if pokemon['region_only'] else gens
+    for gen_num in range(gen, last_gen + 1): # Entries don't add anything outside this range
+        typing = tuple(pokemon['types'][f'gen_{gen_num}'])
+        counted = pokemon['evolves_at'] > gen_num
+        for accumulated in ([False, True] if gen_num == gen else [True]):
+            contributions['generation', gen_num, accumulated] = (typing, counted)
+            if counted:
+                for type in typing:
+                    contributions.setdefault(('type', type, accumulated), []).append(gen_num)
+
+    return contributions
+
+
+def get_affected_tasks(previous: list[dict], source: list[dict], gens: int) -> set[tuple] | None:
+    """Compares two versions of the main resource and returns the build tasks (see `run_task`) whose
+    resources may differ between them. Returns `None` if they can't be compared entry by entry.
+
+    Entries that are the same object in both versions aren't compared at all, and the unchanged
+    start and end of the lists are skipped in one pass, so comparing a refreshed main resource with
+    the one it came from (see `refresh_data`, which only copies the entries it changes) takes time
+    in proportion to the changes, not to its size."""
+
+    length = min(len(previous), len(source))
+    start = next(select(count(), map(is_not, previous, source)), length)
+    end = next(select(count(), map(is_not, reversed(previous), reversed(source))), length) # Counted from the end
+    end = min(end, length - start) # Unchanged entries aren't counted twice
+    previous_window = previous[start:len(previous) - end]
+    window = source[start:len(source) - end]
+
+    kept = set(map(id, previous_window)) & set(map(id, window)) # Entries that only moved
+    removed = [pokemon for pokemon in previous_window if id(pokemon) not in kept]
+    added = [pokemon for pokemon in window if id(pokemon) not in kept]
+    previous_entries = {pokemon['name']: pokemon for pokemon in removed}
+    entries = {pokemon['name']: pokemon for pokemon in added}
+    if len(previous_entries) != len(removed) or len(entries) != len(added):
+        return None # Repeated names
+
+    keys = set()
+    for name in previous_entries.keys() | entries.keys():
+        old, new = previous_entries.get(name), entries.get(name)
+        if old == new:
+            continue
+        old_contributions = get_contributions(old, gens) if old else {}
+        new_contributions = get_contributions(new, gens) if new else {}
+        keys.update(key for key in old_contributions.keys() | new_contributions.keys() if old_contributions.get(key) != new_contributions.get(key))
+
+    tasks = set()
+    for kind, value, accumulated in keys:
+        if kind == 'generation':
+            tasks.update({('generation', value, True, accumulated), ('generation', value, False, accumulated)})
+        else:
+            tasks.add(('type', value, accumulated))
+    return tasks
+
+
+def get_reusable(source: list[dict], types: list[str], gens: int) -> tuple[Pack, set[tuple]] | None:
+    """Finds which resources of the published snapshot can be reused for a build from `source`,
+    returning its pack and the tasks that must be run again. Returns `None` if nothing can be
+    reused, because the snapshot was created from other inputs or without storing its source."""
+
+    try:
+        pack = Pack(get_pack_path())
+        if pack.metadata.get('inputs') != get_inputs_checksum(types, gens):
+            return None
+        previous = built_sources.get(get_current_version()) or read_snapshot_source()
+        if previous is None:
+            return None
+    except (OSError, ValueError, TypeError):
+        return None
+
+    affected = get_affected_tasks(previous, source, gens)
+    return (pack, affected) if affected is not None else None
+
+
+def get_built_checksum() -> str | None:
+    """Returns the checksum of the inputs the published snapshot was created from, if any."""
+
+    path = get_pack_path()
+    try:
+        return Pack(path).metadata.get('checksum') if path else None
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def build(matrix: CountMatrix, types: list[str], workers = 1, checksum: str | None = None, source: list[dict] | None = None, reuse = True, source_file: Path | None = None) -> dict:
+    """Creates every generation and type resource and writes them all to the pack file of a new
+    snapshot, which is then published. With more than one worker, resources are created by a pool
+    of processes, but they are still packed in the same order, so the file is identical to the one
+    created serially. The `checksum` of the inputs is stored in the pack (see `get_checksum`).
+
+    If the main resource the `matrix` comes from is given as `source`, and `reuse` is `True`, only
+    resources it changed since the published snapshot are created again (see
+    `get_affected_tasks`), and the rest are copied from that snapshot. The file it was read from,
+    if given as `source_file`, is stored in the new snapshot (see `add_source`), so later builds can
+    compare with it even in another process. Returns how many
+    resources were rebuilt and reused, and the names of the rebuilt ones."""
+
+    tasks = []
+    for gen in range(1, matrix.gens + 1):
+        for mode in [(True, True), (True, False), (False, False), (False, True)]:
+            tasks.append(('generation', gen, mode[0], mode[1]))
     for type in types:
-        create_type_resource(type, False)
-        create_type_resource(type, True)
+        tasks.append(('type', type, False))
+        tasks.append(('type', type, True))
+
+    reusable = get_reusable(source, types, matrix.gens) if reuse and source is not None else None
+    previous_pack, affected = reusable or (None, None)
+    pending = [task for task in tasks if affected is None or task in affected]
+
+    create = partial(run_task, matrix, types)
+    if workers > 1 and len(pending) > 1:
+        logger.info(f'Creating resources with {workers} processes...')
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = dict(zip(pending, executor.map(create, pending, chunksize=ceil(len(pending) / workers))))
+    else:
+        results = dict(zip(pending, map(create, pending)))
+
+    contents = {}
+    etags = {}
+    for task in tasks:
+        name = get_resource_name(task)
+        if task not in results:
+            contents[name], etags[name] = previous_pack.get_variants(name)
+            continue
+
+        variants, seconds = results[task]
+        contents[name] = variants
+        etags[name] = hashlib.sha256(variants['identity']).hexdigest()
+        metrics.observe('pokeback_build_duration_seconds', seconds, kind=task[0])
+        prefix = '' if task[-1] else 'non-'
+        if task[0] == 'generation':
+            mode = 'partial' if task[2] else 'strict'
+            logger.info(f'Data for generation {task[1]} ({prefix}accumulated, {mode} mode) successfully created in {seconds * 1000:.1f} ms.')
+        else:
+            logger.info(f'Data for {task[1]} type at every generation ({prefix}accumulated) successfully created in {seconds * 1000:.1f} ms.')
+
+    report = {'rebuilt': len(results), 'reused': len(tasks) - len(results), 'resources': [get_resource_name(task) for task in pending]}
+    metrics.increment('pokeback_build_resources_total', report['rebuilt'], outcome='rebuilt')
+    metrics.increment('pokeback_build_resources_total', report['reused'], outcome='reused')
+    if previous_pack:
+        logger.info(f'{report["reused"]} resources were not affected by the changes, and were reused from snapshot {get_current_version()}.')
+
+    version, path = create_snapshot()
+    if source_file is not None:
+        add_source(path, source_file)
+    write_pack(contents, etags, path, {'checksum': checksum, 'inputs': get_inputs_checksum(types, matrix.gens)})
+    publish(version)
+    built_sources.clear()
+    if source is not None:
+        built_sources[version] = source
+    logger.info(f'{len(contents)} resources successfully written and published as snapshot {version}.')
+    return report
+
+
+def update(incremental = True, workers: int | None = None, force = False, progress: Callable[[str], None] | None = None, report: Callable[[dict], None] | None = None, raise_errors = False) -> bool:
+    """Updates all resources. If the main resource is missing or corrupted, it performs all the
+    logic pertaining PokéAPI, including many requests, and creates it from scratch. Otherwise, it
+    works from the preexistent file, which is first refreshed with any new or changed species if
+    `incremental` is `True` (see `refresh_data`).
+
+    Generation and type resources are created by `build`, with the given number of `workers`
+    (defaults to the `BUILD_WORKERS` environment variable), unless they were already created from
+    the same inputs and `force` is `False`. Only those affected by changes to the main resource are
+    created again, unless `force` is `True`. If given, `report` is called with the result of
+    `build`.
+
+    If given, `progress` is called with the name of every stage as it starts (`source`, `listings`,
+    `build` and `publish`). Returns whether the update succeeded. Errors from PokéAPI are logged,
+    and also raised if `raise_errors` is `True`."""
+
+    progress = progress or (lambda stage: None)
+    start = perf_counter()
+    try:
+        progress('source')
+        if not is_source_ok():
+            logger.error('Main resource not found or corrupted. Attemting to create it from scratch...')
+            source = get_data(9999)
+            write_json(source, SOURCEFILE)
+            logger.info('Main data successfully fetched and written to JSON format.')
+        else:
+            source = read_source()
+            if incremental:
+                source, changed = refresh_data(source)
+                if changed:
+                    write_json(source, SOURCEFILE)
+                    logger.info('Main data successfully refreshed and written to JSON format.')
+
+        progress('listings')
+        gens = call('generation', revalidate = True).get('count', 9)
+
+        types_data = call('type', revalidate = True).get('results')
+        types = [result['name'] for result in types_data] if types_data else list(local_types)
+        types.remove('unknown'); types.remove('stellar')
+
+    except RuntimeError as error:
+        logger.critical(error)
+        metrics.observe('pokeback_update_duration_seconds', perf_counter() - start, outcome='failed')
+        if raise_errors:
+            raise
+        return False
+
+    progress('build')
+    dataset = Dataset(source, gens)
+    matrix = CountMatrix(dataset) # Every count and weight, obtained in a single pass over the dataset
+    checksum = get_checksum(get_source_checksum(), types, gens)
+    if not force and checksum == get_built_checksum():
+        logger.info('Inputs haven\'t changed since the last build. Skipping the creation of resources.')
+    else:
+        logger.info('Creating resources for every generation and type...')
+        result = build(matrix, types, workers or build_workers, checksum, source, reuse = not force, source_file = SOURCEFILE)
+        if report:
+            report(result)
 
+    progress('publish')
+    resources.reload()
+    queries.load(matrix, TypeIndex(dataset), types)
+    metrics.observe('pokeback_update_duration_seconds', perf_counter() - start, outcome='updated')
     logger.info('Resources successfully updated.')
+    return True
 
 
-def auto_update():
-    """Schedules periodic resource updates."""
+def auto_update(job: Callable[[], object] = update):
+    """Schedules periodic resource updates, running the given `job`."""
     scheduler = BackgroundScheduler()
     date_to_run = CronTrigger(month=2, day=1, hour=0, minute=0)
 
-    scheduler.add_job(update, date_to_run)
+    scheduler.add_job(job, date_to_run)
     scheduler.start()
     logger.info('Updates scheduled for every February the 2nd.')
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""A persistent, content-addressed cache for responses from PokéAPI."""
+
+
+import gzip, hashlib, json, os, threading
+from time import time
+from pathlib import Path
+
+
+class HttpCache:
+    """Stores response bodies on disk, keyed by URL.
+
+    Bodies are compressed and saved in `objects`, named after the hash of their content, so
+    identical responses are only stored once. Each URL has an entry in `entries` (named after the
+    hash of the URL) pointing to its body, along with the validators (`ETag` and `Last-Modified`)
+    needed to revalidate it once it's older than `ttl` seconds. When the stored bodies take more
+    than `max_size` bytes, the least recently used entries are evicted."""
+
+    def __init__(self, directory: Path, ttl: float, max_size: int):
+        self.objects = directory / 'objects'
+        self.entries = directory / 'entries'
+        self.ttl = ttl
+        self.max_size = max_size
+        self.size = None # Bytes used by objects, computed on first write
+        self.lock = threading.Lock()
+
+
+    def _entry_path(self, url: str) -> Path:
+        return self.entries / (hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+
+    def get(self, url: str) -> dict | None:
+        """Returns the entry stored for the `url`, or `None` if there's none."""
+
+        try:
+            with open(self._entry_path(url)) as file:
+                entry = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        return entry if entry.get('url') == url else None
+
+
+    def is_fresh(self, entry: dict) -> bool:
+        """Checks if an entry can be used without revalidating it."""
+        return time() - entry['stored_at'] < self.ttl
+
+
+    def validators(self, entry: dict) -> dict:
+        """Returns the headers that make a request conditional to the `entry` having changed."""
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+
+    def load(self, entry: dict) -> dict | None:
+        """Returns the parsed body of an `entry`, or `None` if it can't be read. Loading an entry
+        marks it as recently used."""
+
+        try:
+            with open(self.objects / entry['digest'], 'rb') as file:
+                body = gzip.decompress(file.read())
+            os.utime(self._entry_path(entry['url'])) # Access time for the eviction policy
+            return json.loads(body)
+        except (OSError, EOFError, json.JSONDecodeError):
+            return None
+
+
+    def put(self, url: str, body: bytes, etag: str | None = None, last_modified: str | None = None):
+        """Stores the `body` of a response to `url`, along with its validators."""
+
+        digest = hashlib.sha256(body).hexdigest()
+        object_path = self.objects / digest
+
+        with self.lock:
+            self.objects.mkdir(parents=True, exist_ok=True)
+            self.entries.mkdir(parents=True, exist_ok=True)
+            if self.size is None:
+                self.size = sum(path.stat().st_size for path in self.objects.iterdir())
+
+            if not object_path.exists():
+                compressed = gzip.compress(body)
+                self._write(object_path, compressed)
+                self.size += len(compressed)
+
+            entry = {'url': url, 'digest': digest, 'etag': etag, 'last_modified': last_modified, 'stored_at': time()}
+            self._write(self._entry_path(url), json.dumps(entry).encode())
+
+            if self.size > self.max_size:
+                self._evict()
+
+
+    def refresh(self, entry: dict):
+        """Marks an `entry` as fresh again, after the server confirmed it hasn't changed."""
+
+        entry['stored_at'] = time()
+        with self.lock:
+            self._write(self._entry_path(entry['url']), json.dumps(entry).encode())
+
+
+    def _write(self, path: Path, content: bytes):
+        temp_path = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+        with open(temp_path, 'wb') as file:
+            file.write(content)
+        temp_path.replace(path)
+
+
+    def _evict(self):
+        """Deletes the least recently used entries until the objects fit into `max_size` (with some
+        margin, so evictions don't happen on every write), and then every unreferenced object."""
+
+        sizes = {path.name: path.stat().st_size for path in self.objects.iterdir() if not path.name.endswith('.tmp')}
+        references = {} # Digest -> number of entries pointing to it
+        entries = []
+        for path in sorted(self.entries.glob('*.json'), key=lambda path: path.stat().st_mtime):
+            try:
+                digest = json.loads(path.read_text())['digest']
+            except (OSError, json.JSONDecodeError, KeyError):
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((path, digest))
+            references[digest] = references.get(digest, 0) + 1
+
+        size = sum(sizes.get(digest, 0) for digest in references)
+        for path, digest in entries: # Oldest first
+            if size <= self.max_size * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            references[digest] -= 1
+            if references[digest] == 0:
+                del references[digest]
+                size -= sizes.get(digest, 0)
+
+        for name in sizes:
+            if name not in references:
+                (self.objects / name).unlink(missing_ok=True)
+
+        self.size = size
@@ -0,0 +1,66 @@
+"""Leader election between the processes serving the app, so that only one of them schedules and
+runs updates while the rest serve the snapshots it publishes."""
+
+
+import os, logging, threading
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError: # Not available on Windows, where every process leads as if it was alone
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class Leader:
+    """Exclusive lock on a file, taken without waiting. The process that holds it is the leader, and
+    the lock is released when that process exits, even if it crashes, so another one can take over.
+
+    Child processes (such as the workers a server forks after importing the app) don't inherit the
+    leadership, so only the process that took the lock leads."""
+
+    def __init__(self, path_to_file: Path):
+        self.path = path_to_file
+        self.file = None
+        self.is_leader = False
+        self.lock = threading.Lock()
+        os.register_at_fork(after_in_child=self.forget)
+
+
+    def acquire(self) -> bool:
+        """Tries to become the leader. Returns whether this process is the leader."""
+
+        with self.lock:
+            if self.is_leader:
+                return True
+            if fcntl is None:
+                self.is_leader = True
+                return True
+
+            file = open(self.path, 'a+')
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                file.close()
+                return False
+
+            file.seek(0)
+            file.truncate()
+            file.write(str(os.getpid()))
+            file.flush()
+            self.file = file
+            self.is_leader = True
+            logger.info(f'Process {os.getpid()} is now the leader.')
+            return True
+
+
+    def forget(self):
+        """Drops the leadership inherited from a parent process, whose copy of the lock still holds."""
+
+        if self.file:
+            self.file.close()
+        self.file = None
+        self.is_leader = False
+        self.lock = threading.Lock()
+
@@ -0,0 +1,160 @@
+"""Log file handling: size-based rotation with compressed archives, and reading of the current file
+from its end, or as it grows."""
+
+
+import os, gzip, logging, shutil
+from collections.abc import Callable, Iterator
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from time import monotonic, sleep
+
+max_size = int(os.getenv('LOG_MAX_MB', 10)) * 1024 * 1024 # Size at which the log file is rotated
+backups = int(os.getenv('LOG_BACKUPS', 5)) # Archives kept: app.log.1 (the newest), then app.log.2.gz and so on
+
+BLOCK_SIZE = 64 * 1024
+
+
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    """`RotatingFileHandler` that compresses archived log files with gzip. Since rotation isn't safe
+    when many processes write to the same file, only those for which `rotates` returns `True` (the
+    leader, see `Leader`) rotate it. The rest reopen the file whenever it was rotated, like a
+    `WatchedFileHandler`, so they don't keep writing to an archived one.
+
+    A process may still write a last line to the newest archive before it notices, so that one is
+    only compressed on the next rotation, once nobody writes to it."""
+
+    def __init__(self, path_to_file: Path, max_bytes = max_size, backup_count = backups, rotates: Callable[[], bool] = lambda: True):
+        super().__init__(path_to_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.rotates = rotates
+        self.file_id = self.get_file_id()
+
+
+    def get_file_id(self) -> tuple[int, int] | None:
+        """Returns the device and inode of the file at the handler's path, if it exists."""
+
+        try:
+            stat = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        return self.rotates() and super().shouldRollover(record)
+
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        if self.backupCount > 0:
+            base = self.baseFilename
+            for number in range(self.backupCount - 1, 1, -1):
+                if os.path.exists(f'{base}.{number}.gz'):
+                    os.replace(f'{base}.{number}.gz', f'{base}.{number + 1}.gz')
+            if os.path.exists(f'{base}.1'):
+                if self.backupCount > 1:
+                    compress_log(f'{base}.1', f'{base}.2.gz')
+                else:
+                    os.remove(f'{base}.1')
+            if os.path.exists(base):
+                os.replace(base, f'{base}.1')
+
+        if not self.delay:
+            self.stream = self._open()
+
+
+    def emit(self, record: logging.LogRecord):
+        file_id = self.get_file_id()
+        if file_id != self.file_id: # Rotated by another process, or by this one
+            if self.stream:
+                self.stream.close()
+                self.stream = None # Opened again by `emit`
+            self.file_id = file_id
+        super().emit(record)
+        if self.file_id is None:
+            self.file_id = self.get_file_id()
+
+
+def compress_log(source: str, destination: str):
+    """Moves the `source` log file to a gzip archive at `destination`."""
+
+    with open(source, 'rb') as file, gzip.open(destination, 'wb') as archive:
+        shutil.copyfileobj(file, archive)
+    os.remove(source)
+
+
+def tail(path_to_file: Path, lines: int) -> bytes:
+    """Returns the last `lines` lines of a file, reading it backwards by blocks, so only the end of
+    a large file is read."""
+
+    if lines <= 0:
+        return b''
+
+    with open(path_to_file, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        position = end
+        content = b''
+        while position > 0 and content.count(b'\n', 0, len(content) - 1) < lines: # A final newline doesn't start a new line
+            step = min(BLOCK_SIZE, position)
+            position -= step
+            file.seek(position)
+            content = file.read(step) + content
+
+    return b''.join(content.splitlines(keepends=True)[-lines:])
+
+
+def follow(path_to_file: Path, interval = 0.5, heartbeat = 15.0) -> Iterator[bytes | None]:
+    """Yields every complete line appended to a file from now on, checking it every `interval`
+    seconds, until the generator is closed. If the file is rotated, the new one is followed from its
+    start. `None` is yielded whenever `heartbeat` seconds pass without new lines, so the caller can
+    keep its connection alive."""
+
+    file = open(path_to_file, 'rb')
+    try:
+        file.seek(0, os.SEEK_END)
+        pending = b''
+        last_yield = monotonic()
+        while True:
+            chunk = file.read(BLOCK_SIZE)
+            if chunk:
+                pending += chunk
+                *lines, pending = pending.split(b'\n')
+                for line in lines:
+                    yield line + b'\n'
+                    last_yield = monotonic()
+                continue
+
+            try:
+                stat = os.stat(path_to_file)
+            except FileNotFoundError: # Being rotated
+                stat = None
+            if stat and (stat.st_ino != os.fstat(file.fileno()).st_ino or stat.st_size < file.tell()):
+                file.close()
+                file = open(path_to_file, 'rb')
+                pending = b''
+                continue
+
+            if monotonic() - last_yield >= heartbeat:
+                yield None
+                last_yield = monotonic()
+            sleep(interval)
+    finally:
+        file.close()
+
+
+def get_events(path_to_file: Path, lines = 0) -> Iterator[str]:
+    """Yields the last `lines` lines of a file and then every new one (see `follow`) as server-sent
+    events, one per line, with comments as heartbeats."""
+
+    for line in tail(path_to_file, lines).splitlines():
+        text = line.decode(errors='replace')
+        yield f'data: {text}\n\n'
+
+    for line in follow(path_to_file):
+        if line is None:
+            yield ': keep-alive\n\n'
+        else:
+            text = line.rstrip(b'\r\n').decode(errors='replace')
+            yield f'data: {text}\n\n'
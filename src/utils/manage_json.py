@@ -1,47 +1,141 @@
-import json
+import json, hashlib
 from pathlib import Path
-from src.utils.paths import SOURCEFILE
+from src.utils.paths import SOURCEFILE, SOURCE_MANIFEST
+from src.utils.metrics import metrics
+
+SOURCE_SCHEMA = 1 # Must be increased whenever the keys of source entries change
+REQUIRED_KEYS = {'evolves_at', 'name', 'gen', 'region_only', 'types'}
+
+parsed_source = {} # (size, mtime) of the source file -> its content, so it's parsed at most once per version
 
 def read_json(path_to_file: Path) -> dict | list:
     """Shortcut function to open JSON files."""
 
-    with open(path_to_file) as file:
-        data = json.load(file)
+    with metrics.timer('pokeback_file_duration_seconds', operation='read_json'):
+        with open(path_to_file) as file:
+            data = json.load(file)
 
     return data
 
 
 def write_json(data, path_to_file: Path):
-    """Shortcut function to write JSON files."""
+    """Shortcut function to write JSON files. When writing the source file, its manifest is written
+    too (see `is_source_ok`)."""
+
+    content = encode_json(data)
+    with metrics.timer('pokeback_file_duration_seconds', operation='write_json'):
+        temp_path = path_to_file.with_suffix('.tmp')
+        with open(temp_path, 'wb') as file:
+            file.write(content)
+
+        temp_path.replace(path_to_file)
+
+    if path_to_file == SOURCEFILE:
+        write_manifest(hashlib.sha256(content).hexdigest(), len(data))
+        parsed_source.clear()
+        parsed_source[get_source_key()] = data
+
+
+def encode_json(data, minified = False) -> bytes:
+    """Encodes `data` exactly as `write_json` would write it to a file, or without any whitespace if
+    `minified` is `True`."""
+
+    if minified:
+        return json.dumps(data, separators=(',', ':'), sort_keys=True).encode()
+    return json.dumps(data, indent=2, sort_keys=True).encode()
+
+
+def get_source_key() -> tuple[int, int]:
+    """Returns the size and modification time of the source file, which change whenever it does."""
+
+    stat = SOURCEFILE.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_manifest(checksum: str, count: int):
+    """Writes the manifest of the source file, given the SHA-256 `checksum` of its content and its
+    `count` of entries."""
+
+    size, mtime = get_source_key()
+    manifest = {'schema': SOURCE_SCHEMA, 'sha256': checksum, 'count': count, 'size': size, 'mtime_ns': mtime}
+    write_json(manifest, SOURCE_MANIFEST)
 
-    temp_path = path_to_file.with_suffix('.tmp')
-    with open(temp_path, 'w') as file:
-        json.dump(data, file, indent=2, sort_keys=True)
 
-    temp_path.replace(path_to_file)
+def read_source() -> list[dict]:
+    """Returns the content of the source file. It's only parsed the first time, or again if the file
+    changed, so the returned list is shared and must not be modified."""
+
+    key = get_source_key()
+    if key not in parsed_source:
+        content = read_json(SOURCEFILE)
+        parsed_source.clear()
+        parsed_source[key] = content
+    return parsed_source[key]
+
+
+def get_source_checksum() -> str:
+    """Returns the SHA-256 checksum of the source file, as stored in its manifest if that's up to
+    date (see `is_source_ok`), so the file doesn't need to be read."""
+
+    try:
+        manifest = read_json(SOURCE_MANIFEST)
+        if (manifest['size'], manifest['mtime_ns']) == get_source_key():
+            return manifest['sha256']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    with open(SOURCEFILE, 'rb') as file:
+        return hashlib.file_digest(file, 'sha256').hexdigest()
 
 
 def is_source_ok():
-    """Checks if the source file exists and has the correct data inside."""
+    """Checks if the source file exists and has the correct data inside. This is normally a matter of
+    comparing it with its manifest: its size and modification time first, and its hash only if the
+    latter changed (after a checkout, for example). The file is only parsed and checked entry by
+    entry if there's no valid manifest, or if it doesn't match the file (which may have been replaced
+    by a valid one, as by a pull), and the manifest is then written again."""
 
     if not SOURCEFILE.exists():
         return False
 
     try:
-        content = read_json(SOURCEFILE)
+        manifest = read_json(SOURCE_MANIFEST)
+        if manifest.get('schema') != SOURCE_SCHEMA:
+            raise ValueError('Outdated manifest.')
+        size, mtime = get_source_key()
+        if size != manifest['size']:
+            return validate_source()
+        if mtime == manifest['mtime_ns']:
+            return manifest['count'] > 0
+
+        with open(SOURCEFILE, 'rb') as file:
+            checksum = hashlib.file_digest(file, 'sha256').hexdigest()
+    except (OSError, ValueError, AttributeError, KeyError):
+        return validate_source()
+
+    if checksum != manifest['sha256']:
+        return validate_source()
+    write_manifest(checksum, manifest['count']) # Same content, so only the modification time is updated
+    return manifest['count'] > 0
 
-        if not isinstance(content, list):
-            return False
 
-        if len(content) == 0:
+def validate_source():
+    """Checks the source file entry by entry and, if it's valid, writes its manifest."""
+
+    try:
+        content = read_source()
+        if not isinstance(content, list) or len(content) == 0:
             return False
 
-        required_keys = {'evolves_at', 'name', 'gen', 'region_only', 'types'}
         for item in content:
-            if not required_keys.issubset(item.keys()):
+            if not REQUIRED_KEYS.issubset(item.keys()):
                 return False
 
+        with open(SOURCEFILE, 'rb') as file:
+            checksum = hashlib.file_digest(file, 'sha256').hexdigest()
+        write_manifest(checksum, len(content))
+
     except (OSError, json.JSONDecodeError):
         return False
 
-    return True
\ No newline at end of file
+    return True
@@ -0,0 +1,122 @@
+"""Functions to write and read packs: single files holding many resources, with an index of their
+positions so each one can be read without parsing or copying the others."""
+
+
+import gzip, json, mmap, os, struct
+from pathlib import Path
+from src.utils.metrics import metrics
+
+try:
+    import brotli # Optional. Without it, packs only have identity and gzip variants
+except ImportError:
+    brotli = None
+
+MAGIC = b'PKBK'
+VERSION = 3
+HEADER = struct.Struct('<4sBxxxQ') # Magic, version, padding and index length
+
+
+def compress(content: bytes) -> dict[str, bytes]:
+    """Returns the variants of `content` for every supported content coding (`identity`, `gzip`
+    and, if available, `br`). Compression is deterministic, so equal contents give equal packs."""
+
+    variants = {'identity': content, 'gzip': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli:
+        variants['br'] = brotli.compress(content, quality=11)
+    return variants
+
+
+def write_pack(resources: dict[str, dict[str, bytes]], etags: dict[str, str], path_to_file: Path, metadata: dict | None = None):
+    """Writes every item of `resources` into a single pack file, along with their `etags` and any
+    JSON-serializable `metadata` about the pack. Each resource is given as a mapping of content
+    codings to its content in that coding (see `compress`). The file is replaced in one operation,
+    so readers get either the old or the new pack, never a mix."""
+
+    index = {}
+    offset = 0 # Relative to the end of the index
+    for name, variants in resources.items():
+        index[name] = {'etag': etags[name], 'variants': {}}
+        for encoding, content in variants.items():
+            index[name]['variants'][encoding] = [offset, len(content)]
+            offset += len(content)
+
+    encoded_index = json.dumps({'metadata': metadata or {}, 'resources': index}, sort_keys=True).encode()
+
+    with metrics.timer('pokeback_file_duration_seconds', operation='write_pack'):
+        temp_path = path_to_file.with_suffix('.tmp')
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, len(encoded_index)))
+            file.write(encoded_index)
+            for variants in resources.values():
+                for content in variants.values():
+                    file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+
+        temp_path.replace(path_to_file)
+
+
+class Pack:
+    """Read-only view of a pack file. The file is memory-mapped, so only the variants of resources
+    that are asked for are read from it (as `bytes`, which is what WSGI servers accept as a body)."""
+
+    def __init__(self, path_to_file: Path):
+        with open(path_to_file, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) # Stays valid after closing the file
+
+        magic, version, index_length = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path_to_file} is not a valid pack (version {VERSION}).')
+
+        start = HEADER.size + index_length
+        header = json.loads(self.buffer[HEADER.size:start])
+        self.index = header['resources']
+        self.metadata = header['metadata']
+        self.start = start
+
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+    def names(self) -> list[str]:
+        return list(self.index)
+
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Copies `length` bytes of content, starting at `offset` (relative to the end of the index)."""
+
+        start = self.start + offset
+        return self.buffer[start:start + length]
+
+
+    def get(self, name: str, encodings = ('identity',)) -> tuple[bytes, str, str] | None:
+        """Returns the content of the resource with the given `name` in the first of the `encodings`
+        (content codings, in order of preference) it's available in, along with that coding and its
+        ETag. Only that variant is read. Returns `None` if the resource isn't in the pack, or if it
+        isn't available in any of the `encodings`."""
+
+        entry = self.index.get(name)
+        if entry is None:
+            return None
+
+        for encoding in encodings:
+            if encoding in entry['variants']:
+                return self.read(*entry['variants'][encoding]), encoding, entry['etag']
+        return None
+
+
+    def get_variants(self, name: str) -> tuple[dict[str, bytes], str] | None:
+        """Returns every variant (a content coding: content mapping) and the ETag of the resource with
+        the given `name`, or `None` if it isn't in the pack. Variants are in the order they were
+        written in (the index has its keys sorted), so writing them again gives the same pack."""
+
+        entry = self.index.get(name)
+        if entry is None:
+            return None
+        variants = sorted(entry['variants'].items(), key=lambda item: item[1][0]) # By offset
+        return {encoding: self.read(offset, length) for encoding, (offset, length) in variants}, entry['etag']
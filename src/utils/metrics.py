@@ -0,0 +1,105 @@
+"""In-process metrics (counters and histograms), rendered in the Prometheus text format."""
+
+
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0) # Seconds
+
+DESCRIPTIONS = {
+    'pokeback_fetch_duration_seconds': ('histogram', 'Duration of calls to PokéAPI, by endpoint and outcome.'),
+    'pokeback_fetch_retries_total': ('counter', 'Failed attempts to call PokéAPI that were retried, by endpoint.'),
+    'pokeback_build_duration_seconds': ('histogram', 'Duration of the creation of each generation or type resource.'),
+    'pokeback_build_resources_total': ('counter', 'Resources written by builds, by outcome (rebuilt or reused from the previous snapshot).'),
+    'pokeback_update_duration_seconds': ('histogram', 'Duration of full updates, by outcome.'),
+    'pokeback_file_duration_seconds': ('histogram', 'Duration of reads and writes of data files, by operation.'),
+    'pokeback_request_duration_seconds': ('histogram', 'Latency of requests to the API, by route, method and status.'),
+    }
+
+
+class Metrics:
+    """Thread-safe registry of counters and histograms. Every metric can have any number of labels,
+    given as keyword arguments."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {} # Name -> {labels: value}
+        self.histograms = {} # Name -> {labels: [count per bucket..., sum, count]}
+
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + amount
+
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            values = series.get(key)
+            if values is None:
+                values = series[key] = [0] * (len(BUCKETS) + 2)
+            bucket = bisect_left(BUCKETS, value)
+            if bucket < len(BUCKETS): # Larger values only count for the +Inf bucket
+                values[bucket] += 1
+            values[-2] += value
+            values[-1] += 1
+
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observes how long the block inside the `with` statement takes. Labels can be changed (for
+        example, to add an outcome) through the yielded dict."""
+
+        start = perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+
+        lines = []
+        with self.lock:
+            for name, values in sorted(self.counters.items()):
+                self._describe(lines, name)
+                for key, value in sorted(values.items()):
+                    lines.append(f'{name}{format_labels(key)} {value}')
+
+            for name, series in sorted(self.histograms.items()):
+                self._describe(lines, name)
+                for key, values in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, values):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{format_labels(key, le=str(bound))} {cumulative}')
+                    lines.append(f'{name}_bucket{format_labels(key, le="+Inf")} {values[-1]}')
+                    lines.append(f'{name}_sum{format_labels(key)} {values[-2]}')
+                    lines.append(f'{name}_count{format_labels(key)} {values[-1]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+    def _describe(self, lines: list[str], name: str):
+        kind, description = DESCRIPTIONS.get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+
+
+def format_labels(key: tuple, **extra: str) -> str:
+    """Formats label pairs as `{name="value",...}`, escaping values as Prometheus expects."""
+
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+metrics = Metrics()
@@ -5,7 +5,11 @@ from pathlib import Path
 
 ROOT = Path(__file__).parents[2].resolve()
 SRC = ROOT / 'src'
+LOGFILE = SRC / 'app.log'
 DATA = SRC / 'resources' / 'data'
 SOURCEFILE = DATA / 'source.json'
-GENERATIONS = DATA / 'generations'
-TYPES = DATA / 'types'
\ No newline at end of file
+SOURCE_MANIFEST = DATA / 'source.manifest.json'
+SNAPSHOTS = DATA / 'snapshots'
+CACHE = DATA / 'cache'
+LEADER_LOCK = DATA / 'leader.lock'
+JOBS = DATA / 'jobs'
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""Versioned snapshots of the generated resources. Every build is written into a new snapshot
+folder, and then published by pointing a single file at it, so readers always see a complete build
+and older ones stay available for rollbacks."""
+
+
+import os, json, shutil
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from pathlib import Path
+from src.utils.paths import SNAPSHOTS
+
+load_dotenv() # This module may be imported before any other that loads the environment
+
+POINTER = 'CURRENT'
+PACK_NAME = 'resources.pack'
+SOURCE_NAME = 'source.json' # The main resource the pack was created from, to find what changes in the next build
+retention = int(os.getenv('SNAPSHOT_RETENTION', 5)) # Snapshots kept, including the current one
+
+
+def create_snapshot() -> tuple[str, Path]:
+    """Creates an empty folder for a new snapshot, returning its version and the path its pack must
+    be written to. Versions are UTC timestamps, so they sort chronologically."""
+
+    version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    folder = SNAPSHOTS / version
+    folder.mkdir(parents=True)
+    return version, folder / PACK_NAME
+
+
+def get_versions() -> list[str]:
+    """Returns the version of every complete snapshot, oldest first."""
+
+    if not SNAPSHOTS.exists():
+        return []
+    return sorted(path.parent.name for path in SNAPSHOTS.glob(f'*/{PACK_NAME}'))
+
+
+def get_current_version() -> str | None:
+    """Returns the version of the published snapshot, if any."""
+
+    try:
+        version = (SNAPSHOTS / POINTER).read_text().strip()
+    except OSError:
+        return None
+    return version if (SNAPSHOTS / version / PACK_NAME).exists() else None
+
+
+def get_pack_path(version: str | None = None) -> Path | None:
+    """Returns the path of the pack of a snapshot (the published one by default), if it exists."""
+
+    version = version or get_current_version()
+    return SNAPSHOTS / version / PACK_NAME if version else None
+
+
+def get_source_path(version: str | None = None) -> Path | None:
+    """Returns the path of the main resource stored with a snapshot (the published one by default).
+    It may not exist, since snapshots don't need it."""
+
+    version = version or get_current_version()
+    return SNAPSHOTS / version / SOURCE_NAME if version else None
+
+
+def read_snapshot_source(version: str | None = None) -> list[dict] | None:
+    """Returns the main resource stored with a snapshot (the published one by default), or `None` if
+    it wasn't stored."""
+
+    path = get_source_path(version)
+    if path is None or not path.exists():
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def add_source(path_to_pack: Path, source_file: Path):
+    """Stores the main resource a pack is being created from, given the file it was read from, in
+    the snapshot of that pack. The file is hard-linked rather than copied when possible, so nothing
+    is written (and replacing the file later doesn't change the snapshot)."""
+
+    destination = path_to_pack.with_name(SOURCE_NAME)
+    try:
+        os.link(source_file, destination)
+    except OSError: # Another file system, or no hard links at all
+        shutil.copyfile(source_file, destination)
+
+
+def publish(version: str):
+    """Points the published snapshot to the given `version`, in one atomic operation, and deletes
+    the oldest snapshots beyond the retention limit."""
+
+    if version not in get_versions():
+        raise ValueError(f'Snapshot {version} doesn\'t exist.')
+
+    temp_path = SNAPSHOTS / f'{POINTER}.tmp'
+    temp_path.write_text(version)
+    temp_path.replace(SNAPSHOTS / POINTER)
+    prune(version)
+
+
+def prune(current: str):
+    """Deletes the oldest snapshots, keeping `retention` of them plus the `current` one (which is
+    always kept, even with a retention of 0), as well as leftovers from builds that never finished."""
+
+    versions = get_versions()
+    keep = set(versions[-retention:] if retention > 0 else []) | {current} # [-0:] would keep them all
+    for path in SNAPSHOTS.iterdir():
+        if path.is_dir() and path.name not in keep and (path.name in versions or path.name < current):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def get_previous_version() -> str | None:
+    """Returns the version published before the current one, which is what rollbacks go back to."""
+
+    versions = get_versions()
+    current = get_current_version()
+    older = [version for version in versions if current is None or version < current]
+    return older[-1] if older else None
@@ -0,0 +1,90 @@
+"""Checks that builds reusing resources of the published snapshot (see `get_affected_tasks`) write
+the same pack as building everything again, for random changes to the main resource.
+
+Run it from the root of the project with:
+
+```bash
+poetry run python -m unittest tests.test_build
+```
+"""
+
+
+import random, tempfile, unittest
+from pathlib import Path
+from unittest.mock import patch
+from benchmarks.run import LOCAL_TYPES
+from benchmarks.synthetic import GENS, make_source, random_typing
+from src.resources import updater
+from src.resources.dataset import Dataset
+from src.resources.calculations import CountMatrix
+from src.utils.snapshots import get_pack_path
+
+ITERATIONS = 40
+
+
+def change(rng: random.Random, source: list[dict], number: int) -> list[dict]:
+    """Returns a new version of the `source` with a few random changes, copying only the entries
+    it changes (like `refresh_data`). New entries are named after `number`."""
+
+    source = list(source)
+    for _ in range(rng.randint(1, 3)):
+        row = rng.randrange(len(source))
+        kind = rng.choice(['types', 'evolves_at', 'region_only', 'removed', 'added'])
+        if kind == 'removed':
+            del source[row]
+            continue
+
+        pokemon = dict(source[row])
+        if kind == 'types':
+            since = rng.randint(pokemon['gen'], GENS)
+            typing = random_typing(rng, since)
+            pokemon['types'] = {f'gen_{gen_num}': typing if gen_num >= since else pokemon['types'][f'gen_{gen_num}'] for gen_num in range(1, GENS + 1)}
+        elif kind == 'evolves_at':
+            pokemon['evolves_at'] = rng.choice([999, rng.randint(pokemon['gen'], GENS)])
+        elif kind == 'region_only':
+            pokemon['region_only'] = not pokemon['region_only']
+
+        if kind == 'added':
+            pokemon['name'] = f'added-{number}'
+            number += 1
+            source.insert(row, pokemon)
+        else:
+            source[row] = pokemon
+    return source
+
+
+class TestBuild(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for stub in (patch('src.utils.snapshots.SNAPSHOTS', Path(directory.name) / 'snapshots'),
+                     patch.dict(updater.built_sources, clear=True)):
+            stub.start()
+            self.addCleanup(stub.stop)
+
+
+    def build(self, source: list[dict], reuse: bool) -> tuple[dict, bytes]:
+        report = updater.build(CountMatrix(Dataset(source, GENS)), LOCAL_TYPES, source = source, reuse = reuse)
+        return report, get_pack_path().read_bytes()
+
+
+    def test_incremental_builds_match_full_builds(self):
+        rng = random.Random(0)
+        source = make_source(1)
+        self.build(source, reuse = False)
+
+        reused = 0
+        for iteration in range(ITERATIONS):
+            source = change(rng, source, iteration * 3)
+            with self.subTest(iteration=iteration):
+                report, incremental = self.build(source, reuse = True)
+                _, full = self.build(source, reuse = False)
+                self.assertEqual(incremental, full)
+                reused += report['reused']
+
+        self.assertGreater(reused, 0) # Otherwise, nothing was compared
+
+
+if __name__ == '__main__':
+    unittest.main()
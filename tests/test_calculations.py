@@ -0,0 +1,61 @@
+"""Checks that the precomputed structures of `calculations.py` give the same counts and weights as
+`get_types_count` and `get_total_type_weight`, which read the dataset on every call.
+
+Run it from the root of the project with:
+
+```bash
+poetry run python -m unittest tests.test_calculations
+```
+"""
+
+
+import unittest
+from benchmarks.run import LOCAL_TYPES
+from benchmarks.synthetic import GENS, make_source
+from src.resources.dataset import Dataset
+from src.resources.calculations import CountMatrix, TypeIndex, get_total_type_weight, get_types_count, get_typings
+
+
+class TestCalculations(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dataset = Dataset(make_source(1), GENS)
+
+
+    def assert_same_results(self, structure):
+        """Compares every count and weight read from the `structure` with the reference functions."""
+
+        for gen_num in range(1, GENS + 1):
+            for accumulated in (False, True):
+                with self.subTest(gen_num=gen_num, accumulated=accumulated):
+                    for partial in (False, True):
+                        for typing in get_typings(LOCAL_TYPES, gen_num, partial):
+                            expected = get_types_count(self.dataset, gen_num, *typing, partial = partial, accumulated = accumulated)
+                            self.assertEqual(structure.count(gen_num, *typing, partial = partial, accumulated = accumulated), expected, typing)
+                    for type in LOCAL_TYPES:
+                        expected = get_total_type_weight(self.dataset, gen_num, type, accumulated = accumulated)
+                        self.assertEqual(structure.weight(gen_num, type, accumulated = accumulated), expected, type)
+
+
+    def test_count_matrix(self):
+        self.assert_same_results(CountMatrix(self.dataset))
+
+
+    def test_type_index(self):
+        index = TypeIndex(self.dataset)
+        self.assert_same_results(index)
+
+        for gen_num in range(1, GENS + 1):
+            with self.subTest(gen_num=gen_num):
+                for typing in get_typings(LOCAL_TYPES, gen_num):
+                    names = index.names(index.members(gen_num, *typing, accumulated = True))
+                    self.assertEqual(len(names), index.count(gen_num, *typing, accumulated = True), typing)
+                    rows = [self.dataset.names.index(name) for name in names]
+                    self.assertEqual(rows, sorted(rows)) # In the order of the dataset
+                    for row in rows:
+                        self.assertEqual(sorted(self.dataset.typing(row, gen_num)), sorted(typing))
+
+
+if __name__ == '__main__':
+    unittest.main()
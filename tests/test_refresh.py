@@ -0,0 +1,108 @@
+"""Refreshes the main resource from a local stand-in of PokéAPI (see `benchmarks/pokeapi.py`) whose
+data changes between crawls, with the HTTP cache enabled.
+
+Run it from the root of the project with:
+
+```bash
+poetry run python -m unittest tests.test_refresh
+```
+"""
+
+
+import hashlib, json, tempfile, unittest, zipfile
+from pathlib import Path
+from unittest.mock import patch
+from benchmarks.pokeapi import METADATA, StandIn
+from src.resources import fetcher
+from src.utils.http_cache import HttpCache
+
+RECORDED_URL = 'https://pokeapi.test/api/v2/'
+GENS = 2
+
+
+def make_api(base_url: str, chains: list[list[tuple[int, str, list[str]]]]) -> dict[str, dict]:
+    """Returns the responses of every endpoint crawled by `get_data`, for the given evolution
+    `chains`. Each chain is a list of `(number, name, types)` species, each evolving into the next."""
+
+    species_listing = []
+    responses = {}
+    for chain_id, chain in enumerate(chains, start=1):
+        link = None
+        for number, name, types in reversed(chain):
+            link = {'species': {'name': name, 'url': f'{base_url}pokemon-species/{number}/'}, 'evolves_to': [link] if link else []}
+            species_listing.append({'name': name, 'url': f'{base_url}pokemon-species/{number}/'})
+            responses[f'pokemon-species/{number}/'] = {
+                'name': name,
+                'generation': {'name': 'generation-i'},
+                'pokedex_numbers': [{'entry_number': number, 'pokedex': {'name': 'national'}}],
+                'varieties': [{'is_default': True, 'pokemon': {'name': name, 'url': f'{base_url}pokemon/{number}/'}}],
+                'evolution_chain': {'url': f'{base_url}evolution-chain/{chain_id}/'}}
+            responses[f'pokemon/{number}/'] = {'name': name, 'types': [{'type': {'name': type}} for type in types], 'past_types': []}
+        responses[f'evolution-chain/{chain_id}/'] = {'id': chain_id, 'chain': link}
+
+    species_listing.sort(key=lambda species: fetcher.get_species_id(species['url']))
+    responses['pokemon-species?limit=9999'] = {'count': len(species_listing), 'results': species_listing}
+    responses['evolution-chain?limit=9999'] = {'count': len(chains), 'results': [{'url': f'{base_url}evolution-chain/{chain_id}/'} for chain_id in range(1, len(chains) + 1)]}
+    responses['generation'] = {'count': GENS}
+    return responses
+
+
+def serve(server: StandIn, responses: dict[str, dict]):
+    """Replaces the responses of the `server`, as if PokéAPI changed."""
+
+    server.responses = {}
+    for endpoint, data in responses.items():
+        content = json.dumps(data).encode()
+        server.responses[endpoint] = (content, f'"{hashlib.sha256(content).hexdigest()}"')
+
+
+class TestRefresh(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive = Path(directory.name) / 'pokeapi.zip'
+        with zipfile.ZipFile(archive, 'w') as file:
+            file.writestr(METADATA, json.dumps({'base_url': RECORDED_URL}))
+
+        self.server = StandIn(archive).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        for stub in (patch.object(fetcher, 'base_url', self.server.base_url),
+                     patch.object(fetcher, 'cache', HttpCache(Path(directory.name) / 'cache', 30 * 24 * 60 * 60, 2 ** 30)),
+                     patch.object(fetcher, 'limiter', fetcher.RateLimiter(1e6)),
+                     patch.dict(fetcher.crawled_species, clear=True)):
+            stub.start()
+            self.addCleanup(stub.stop)
+
+
+    def test_new_evolution_of_a_cached_chain(self):
+        """A species that evolves from a last evolution replaces it, even though its chain was cached
+        (and is still fresh) from the previous crawl."""
+
+        chains = [[(1, 'aaa', ['fire']), (2, 'bbb', ['fire', 'flying'])], [(3, 'ddd', ['water'])]]
+        serve(self.server, make_api(self.server.base_url, chains))
+        source = fetcher.get_data(9999, max_workers = 1)
+        self.assertEqual([pokemon['name'] for pokemon in source], ['bbb', 'ddd'])
+
+        chains[0].append((4, 'ccc', ['dragon']))
+        serve(self.server, make_api(self.server.base_url, chains))
+        refreshed, changed = fetcher.refresh_data(source, max_workers = 1)
+        self.assertTrue(changed)
+        self.assertEqual([pokemon['name'] for pokemon in refreshed], ['ccc', 'ddd'])
+        self.assertEqual(refreshed[0]['types'], {'gen_1': ['dragon'], 'gen_2': ['dragon']})
+
+
+    def test_unchanged_api(self):
+        chains = [[(1, 'aaa', ['fire']), (2, 'bbb', ['fire', 'flying'])], [(3, 'ddd', ['water'])]]
+        serve(self.server, make_api(self.server.base_url, chains))
+        source = fetcher.get_data(9999, max_workers = 1)
+
+        refreshed, changed = fetcher.refresh_data(source, max_workers = 1)
+        self.assertFalse(changed)
+        self.assertEqual(refreshed, source)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Serves resources through a real WSGI server, which (unlike Flask's test client) checks that
+responses are made of bytes.
+
+Run it from the root of the project with:
+
+```bash
+poetry run python -m unittest tests.test_serving
+```
+"""
+
+
+import gzip, json, os, tempfile, threading, unittest
+from pathlib import Path
+import requests
+from werkzeug.serving import make_server
+from benchmarks.run import stub_network
+from benchmarks.synthetic import make_source
+
+ROUTES = [
+    '/types/fire',
+    '/generations/1/partial/accumulated',
+    '/types?names=fire,water',
+    '/generations?mode=strict&gens=1-2&format=ndjson',
+    ]
+
+
+class TestServing(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.patches = stub_network(make_source(1), Path(cls.directory.name))
+        for stub in cls.patches:
+            stub.start()
+
+        from src.resources.updater import update
+        update(incremental = False, force = True) # Publishes a snapshot before the app loads one
+        os.environ['FAST_START'] = '0'
+        from src.app import app
+
+        cls.server = make_server('127.0.0.1', 0, app, threaded=True)
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        for stub in cls.patches:
+            stub.stop()
+        cls.directory.cleanup()
+
+
+    def test_resources_are_served_whole(self):
+        for route in ROUTES:
+            for encoding in ('identity', 'gzip'):
+                with self.subTest(route=route, encoding=encoding):
+                    response = requests.get(self.url + route, headers={'Accept-Encoding': encoding}, stream=True)
+                    body = response.raw.read() # As sent, without decoding it
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(len(body), int(response.headers['Content-Length']))
+                    if response.headers.get('Content-Encoding') == 'gzip': # Batches are only sent as they are
+                        body = gzip.decompress(body)
+                    for line in body.splitlines() if 'ndjson' in route else [body]:
+                        json.loads(line)
+
+
+if __name__ == '__main__':
+    unittest.main()